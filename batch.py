@@ -0,0 +1,106 @@
+import argparse
+import asyncio
+import re
+from chunking import estimate_tokens
+
+URL_RE = re.compile(r"https?://\S+")
+ITEM_MARKER_RE = re.compile(r"^=== *(\d+) *===\s*$", re.MULTILINE)
+
+
+def strip_trailing_punctuation(url):
+    """Drop sentence punctuation after a URL. A closing paren only goes when it is
+    unbalanced, so links like .../Python_(programming_language) stay intact."""
+    while True:
+        url = url.rstrip(".,;")
+        if url.endswith(")") and url.count(")") > url.count("("):
+            url = url[:-1]
+            continue
+        return url
+
+
+def parse_batch_items(text):
+    """URLs from a /batch message in order of appearance, duplicates dropped"""
+    items = []
+    for url in URL_RE.findall(text):
+        url = strip_trailing_punctuation(url)
+        if url not in items: items.append(url)
+    return items
+
+
+def pack_items(items, max_tokens):
+    """Group (index, text) pairs so each group fits in one request.
+    Items larger than max_tokens are returned separately and need their own map-reduce."""
+    groups, large = [], []
+    group, group_tokens = [], 0
+    for index, text in items:
+        tokens = estimate_tokens(text)
+        if tokens > max_tokens:
+            large.append((index, text))
+            continue
+        if group and group_tokens + tokens > max_tokens:
+            groups.append(group)
+            group, group_tokens = [], 0
+        group.append((index, text))
+        group_tokens += tokens
+    if group: groups.append(group)
+    return groups, large
+
+
+def build_packed_prompt(group):
+    documents = '\n\n'.join(f"=== {n} ===\n{text}" for n, (_, text) in enumerate(group, 1))
+    return (
+        f"Below are {len(group)} separate documents, each starting with a line like '=== N ==='.\n"
+        "Extract and present the key information of EACH document separately. "
+        "For every document output the same '=== N ===' line followed by its summary, in the original order. "
+        "Never mix information between documents.\n\n"
+        f"{documents}"
+    )
+
+
+def parse_packed_summaries(text, count):
+    """Split a packed answer back into per-document summaries, {position: summary}"""
+    parts = ITEM_MARKER_RE.split(text or "")
+    summaries = {}
+    for number, body in zip(parts[1::2], parts[2::2]):
+        n = int(number)
+        if 1 <= n <= count and body.strip(): summaries[n] = body.strip()
+    return summaries
+
+
+def format_item(n, source, summary):
+    return f"{n}. {source}\n{summary}"
+
+
+def cli():
+    parser = argparse.ArgumentParser(description="Summarize many URLs and files at once and print a combined digest")
+    parser.add_argument("items", nargs="*", help="URLs, YouTube links or local .pdf/.txt/.md files")
+    parser.add_argument("-f", "--from-file", action="append", default=[], help="file with one item per line")
+    parser.add_argument("--lang", help="summary language, TS_LANG by default")
+    args = parser.parse_args()
+
+    items = list(args.items)
+    for path in args.from_file:
+        with open(path, encoding="utf-8") as f:
+            items += [line.strip() for line in f if line.strip() and not line.startswith('#')]
+    items = list(dict.fromkeys(items))
+    if not items: parser.error("nothing to summarize")
+
+    # main reads its configuration at import, only needed once the arguments are valid
+    import main
+    asyncio.run(run_cli(main, items, args.lang))
+
+
+async def run_cli(main, items, target_lang):
+    try:
+        digest, results = await main.summarize_batch(items, target_lang=target_lang,
+                                                     on_progress=lambda text: print(text.splitlines()[0], flush=True))
+    finally:
+        if main.process_pool: main.process_pool.shutdown()
+        if main.http_fetcher: await main.http_fetcher.close()
+    print(f"\n{digest}\n")
+    for n, (source, summary) in enumerate(results, 1):
+        print(format_item(n, source, summary) + "\n")
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,76 @@
+"""Synthetic inputs for the benchmarks: long articles, multi-hundred-page PDFs, long transcripts."""
+import random
+
+WORDS_EN = ("the model data system result value process study method analysis user network time "
+            "energy market policy growth theory signal language memory design report").split()
+WORDS_RU = ("система данные результат процесс анализ модель время рынок политика рост теория "
+            "сигнал язык память проект отчёт исследование метод значение сеть").split()
+
+
+def sentence(rng, words):
+    text = " ".join(rng.choice(words) for _ in range(rng.randint(8, 20)))
+    return text[0].upper() + text[1:] + rng.choice(".!?")
+
+
+def paragraph(rng, words):
+    return " ".join(sentence(rng, words) for _ in range(rng.randint(3, 8)))
+
+
+def long_text(chars=500_000, lang="en", seed=1):
+    """Newline-separated paragraphs, like a pasted article or book chapter"""
+    rng = random.Random(seed)
+    words = WORDS_RU if lang == "ru" else WORDS_EN
+    paragraphs, size = [], 0
+    while size < chars:
+        p = paragraph(rng, words)
+        paragraphs.append(p)
+        size += len(p) + 1
+    return "\n".join(paragraphs)
+
+
+def transcript_segments(minutes=90, seed=1):
+    """(start, duration, text) segments without punctuation, like auto-generated captions"""
+    rng = random.Random(seed)
+    segments, t = [], 0.0
+    while t < minutes * 60:
+        duration = rng.uniform(1.5, 4.0)
+        text = " ".join(rng.choice(WORDS_EN) for _ in range(rng.randint(4, 10)))
+        segments.append((round(t, 2), round(duration, 2), text))
+        # Occasional longer pauses give the paragraph splitter natural boundaries
+        t += duration + (rng.uniform(2.0, 4.0) if rng.random() < 0.05 else 0.1)
+    return segments
+
+
+def _pdf_escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(path, pages=300, lines_per_page=40, seed=1):
+    """Write a text PDF without any PDF library: one Helvetica text object per page"""
+    rng = random.Random(seed)
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>"]
+    kids = " ".join(f"{4 + 2 * i} 0 R" for i in range(pages))
+    objects.append(f"<< /Type /Pages /Kids [{kids}] /Count {pages} >>".encode())
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    for i in range(pages):
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>".encode()
+        )
+        lines = [_pdf_escape(sentence(rng, WORDS_EN)) for _ in range(lines_per_page)]
+        ops = ["BT /F1 9 Tf 11 TL 40 760 Td"] + [f"({line}) Tj T*" for line in lines] + ["ET"]
+        stream = "\n".join(ops).encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n".encode() + body + b"\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for offset in offsets: out += f"{offset:010d} 00000 n \n".encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    with open(path, "wb") as f:
+        f.write(out)
+    return path
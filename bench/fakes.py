@@ -0,0 +1,172 @@
+"""Local stand-ins for genai.Client and the Telegram Bot API used by the benchmarks."""
+import asyncio
+import os
+import random
+import time
+from types import SimpleNamespace
+
+
+class FakeRateLimitError(Exception):
+    pass
+
+
+class FakeModels:
+    def __init__(self, owner):
+        self.owner = owner
+
+    async def generate_content(self, model, contents, config=None):
+        text, usage = await self.owner.respond(model, contents)
+        return SimpleNamespace(text=text, usage_metadata=usage)
+
+    async def generate_content_stream(self, model, contents, config=None):
+        text, usage = await self.owner.respond(model, contents)
+        words = text.split(" ")
+        # Gemini streams a few dozen tokens per chunk
+        pieces = [" ".join(words[i:i + 30]) for i in range(0, len(words), 30)]
+
+        async def stream():
+            for i, piece in enumerate(pieces):
+                await asyncio.sleep(self.owner.stream_delay)
+                last = i == len(pieces) - 1
+                yield SimpleNamespace(text=piece + ("" if last else " "), usage_metadata=usage if last else None)
+        return stream()
+
+
+class FakeFiles:
+    def __init__(self, owner):
+        self.owner = owner
+
+    async def upload(self, file, config=None):
+        self.owner.calls["upload"] += 1
+        await asyncio.sleep(self.owner.latency)
+        name = f"files/fake-{self.owner.calls['upload']}"
+        return SimpleNamespace(name=name, uri=f"https://fake/{name}", state="ACTIVE")
+
+    async def get(self, name, config=None):
+        return SimpleNamespace(name=name, uri=f"https://fake/{name}", state="ACTIVE")
+
+
+class FakeGenaiClient:
+    """Mimics client.aio of google-genai: configurable latency (plus a per-token cost),
+    429 injection and token counts. Summaries are a fixed fraction of the input size."""
+
+    def __init__(self, latency=0.2, per_1k_tokens=0.01, rate_limit_ratio=0.0, output_ratio=0.1,
+                 stream_delay=0.02, seed=1):
+        self.latency = latency
+        self.per_1k_tokens = per_1k_tokens
+        self.rate_limit_ratio = rate_limit_ratio
+        self.output_ratio = output_ratio
+        self.stream_delay = stream_delay
+        self.random = random.Random(seed)
+        self.calls = {"generate": 0, "rate_limited": 0, "upload": 0}
+        self.tokens_in = 0
+        self.tokens_out = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.aio = SimpleNamespace(models=FakeModels(self), files=FakeFiles(self))
+
+    async def respond(self, model, contents):
+        prompt = contents if isinstance(contents, str) else " ".join(c for c in contents if isinstance(c, str))
+        tokens_in = len(prompt) // 4 + 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency + tokens_in / 1000 * self.per_1k_tokens)
+            if self.random.random() < self.rate_limit_ratio:
+                self.calls["rate_limited"] += 1
+                raise FakeRateLimitError("429 RESOURCE_EXHAUSTED {'retryDelay': '1s'}")
+        finally:
+            self.in_flight -= 1
+        self.calls["generate"] += 1
+        tokens_out = max(20, int(tokens_in * self.output_ratio))
+        self.tokens_in += tokens_in
+        self.tokens_out += tokens_out
+        words = ["summary"] * tokens_out
+        text = f"Point {self.calls['generate']}: " + " ".join(words)
+        usage = SimpleNamespace(prompt_token_count=tokens_in, candidates_token_count=tokens_out,
+                                total_token_count=tokens_in + tokens_out)
+        return text, usage
+
+
+class FakeMessage:
+    def __init__(self, bot, chat_id, text="", document=None):
+        self.bot = bot
+        self.chat_id = chat_id
+        bot.message_ids += 1
+        self.message_id = bot.message_ids
+        self.text = text
+        self.document = document
+        self.photo = self.voice = self.audio = self.video = self.video_note = None
+
+    async def reply_text(self, text, reply_markup=None, **kwargs):
+        return await self.bot.send_message(chat_id=self.chat_id, text=text, reply_markup=reply_markup)
+
+    async def edit_text(self, text, reply_markup=None, **kwargs):
+        await asyncio.sleep(self.bot.latency)
+        self.bot.edits += 1
+        self.text = text
+        if reply_markup is not None: self.bot.finished(self.chat_id)
+        return self
+
+
+class FakeFile:
+    def __init__(self, path):
+        self.path = path
+
+    async def download_to_drive(self, custom_path):
+        with open(self.path, "rb") as src, open(custom_path, "wb") as dst:
+            dst.write(src.read())
+
+    async def download_as_bytearray(self):
+        with open(self.path, "rb") as src:
+            return bytearray(src.read())
+
+
+class FakeBot:
+    """Records what the handlers send. A reply carrying the inline keyboard marks the
+    request of that chat as finished."""
+
+    def __init__(self, latency=0.01):
+        self.latency = latency
+        self.files = {}
+        self.sent = 0
+        self.edits = 0
+        self.message_ids = 0
+        self.done = {}
+
+    def finished(self, chat_id):
+        event = self.done.get(chat_id)
+        if event: event.set()
+
+    def expect(self, chat_id):
+        self.done[chat_id] = asyncio.Event()
+        return self.done[chat_id]
+
+    async def send_message(self, chat_id, text, reply_markup=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        self.sent += 1
+        if reply_markup is not None: self.finished(chat_id)
+        return FakeMessage(self, chat_id, text)
+
+    async def send_chat_action(self, chat_id, action, **kwargs):
+        await asyncio.sleep(self.latency)
+
+    async def get_file(self, file_id):
+        key = getattr(file_id, "file_id", file_id)
+        return FakeFile(self.files[key])
+
+
+def make_text_update(bot, chat_id, text):
+    message = FakeMessage(bot, chat_id, text)
+    update = SimpleNamespace(effective_chat=SimpleNamespace(id=chat_id), message=message, effective_message=message)
+    return update, SimpleNamespace(bot=bot)
+
+
+def make_document_update(bot, chat_id, path, mime_type="application/pdf"):
+    file_id = f"file-{chat_id}-{time.monotonic_ns()}"
+    bot.files[file_id] = path
+    document = SimpleNamespace(file_id=file_id, file_unique_id=file_id, mime_type=mime_type,
+                               file_size=os.path.getsize(path))
+    message = FakeMessage(bot, chat_id, document=document)
+    update = SimpleNamespace(effective_chat=SimpleNamespace(id=chat_id), message=message, effective_message=message)
+    return update, SimpleNamespace(bot=bot)
@@ -0,0 +1,236 @@
+"""Offline benchmarks for the summarization hot paths.
+
+Runs against FakeGenaiClient and FakeBot, so no API quota or network is used:
+
+    python -m bench.run                       # all scenarios
+    python -m bench.run pdf handlers --json bench_output.txt
+    python -m bench.run --compare baseline.json --tolerance 0.25
+
+--compare exits with status 1 when a scenario's p50 latency or peak memory grew by more
+than the tolerance compared to a previous --json result.
+"""
+import argparse
+import asyncio
+import contextlib
+import importlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Caches would turn every repeated run into a cache hit, the limiter and metrics server
+# are not what we measure here. The journal and document store must not leave fake jobs
+# and replies in the bot's data directory. Set before main is imported, explicit env wins.
+for key, value in {"CACHE_PATH": "", "PAGE_CACHE_PATH": "", "TRANSCRIPT_CACHE_PATH": "",
+                   "GEMINI_FILES_CACHE_PATH": "", "CONTEXT_CACHE_PATH": "",
+                   "JOURNAL_PATH": "", "DOC_STORE_PATH": "",
+                   "GEMINI_RPM": "0", "GEMINI_TPM": "0",
+                   "METRICS_PORT": "0", "TQDM_DISABLE": "1"}.items():
+    os.environ.setdefault(key, value)
+
+import main  # noqa: E402
+from bench import corpus  # noqa: E402
+from bench.fakes import FakeBot, FakeGenaiClient, make_document_update, make_text_update  # noqa: E402
+from chunking import iter_chunks  # noqa: E402
+from youtube_transcripts import segments_to_paragraphs  # noqa: E402
+
+
+def percentile(values, q):
+    if not values: return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+class Scenario:
+    def __init__(self, name):
+        self.name = name
+        self.latencies = []
+        self.extra = {}
+
+    def report(self, wall, peak_bytes, fake):
+        result = {
+            "requests": len(self.latencies),
+            "p50": round(percentile(self.latencies, 0.5), 4),
+            "p90": round(percentile(self.latencies, 0.9), 4),
+            "p99": round(percentile(self.latencies, 0.99), 4),
+            "throughput_rps": round(len(self.latencies) / wall, 3) if wall else 0.0,
+            "wall_seconds": round(wall, 3),
+            "peak_mb": round(peak_bytes / 1024 / 1024, 2),
+        }
+        if fake:
+            result.update({"gemini_calls": fake.calls["generate"], "rate_limited": fake.calls["rate_limited"],
+                           "tokens_in": fake.tokens_in, "tokens_out": fake.tokens_out,
+                           "max_in_flight": fake.max_in_flight})
+        result.update(self.extra)
+        return result
+
+
+def install_fake_client(args):
+    fake = FakeGenaiClient(latency=args.latency, rate_limit_ratio=args.rate_limit_ratio)
+    main.client = fake
+    return fake
+
+
+async def bench_chunking(args, scenario):
+    text = corpus.long_text(chars=args.text_chars * 5, lang="ru")
+    paragraphs = text.split("\n")
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        chunks = list(iter_chunks(paragraphs, main.chunk_tokens, main.chunk_overlap_tokens))
+        scenario.latencies.append(time.perf_counter() - started)
+    scenario.extra["chunks"] = len(chunks)
+    return None
+
+
+async def bench_summarize(args, scenario):
+    fake = install_fake_client(args)
+    paragraphs = corpus.long_text(chars=args.text_chars).split("\n")
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        await main.summarize(paragraphs)
+        scenario.latencies.append(time.perf_counter() - started)
+    return fake
+
+
+async def bench_transcript(args, scenario):
+    fake = install_fake_client(args)
+    segments = corpus.transcript_segments(minutes=args.transcript_minutes)
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        await main.summarize(segments_to_paragraphs(segments))
+        scenario.latencies.append(time.perf_counter() - started)
+    return fake
+
+
+async def run_until_replied(bot, chat_ids, submit, timeout):
+    events = {chat_id: bot.expect(chat_id) for chat_id in chat_ids}
+    started = {}
+    for chat_id in chat_ids:
+        started[chat_id] = time.perf_counter()
+        await submit(chat_id)
+
+    async def wait(chat_id):
+        await asyncio.wait_for(events[chat_id].wait(), timeout)
+        return time.perf_counter() - started[chat_id]
+    return await asyncio.gather(*(wait(chat_id) for chat_id in chat_ids))
+
+
+async def bench_pdf(args, scenario):
+    fake = install_fake_client(args)
+    bot = FakeBot()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = corpus.write_pdf(os.path.join(tmp, "book.pdf"), pages=args.pdf_pages)
+        scenario.extra["pdf_mb"] = round(os.path.getsize(path) / 1024 / 1024, 2)
+
+        async def submit(chat_id):
+            update, context = make_document_update(bot, chat_id, path)
+            await main.handle_document(update, context)
+        for i in range(args.repeat):
+            scenario.latencies += await run_until_replied(bot, [1000 + i], submit, args.timeout)
+    return fake
+
+
+async def bench_handlers(args, scenario):
+    fake = install_fake_client(args)
+    bot = FakeBot()
+    texts = [corpus.long_text(chars=args.handler_chars, seed=i) for i in range(args.chats)]
+
+    async def submit(chat_id):
+        update, context = make_text_update(bot, chat_id, texts[chat_id % len(texts)])
+        await main.handle_summarize(update, context)
+    scenario.latencies += await run_until_replied(bot, list(range(args.chats)), submit, args.timeout)
+    scenario.extra.update({"telegram_sends": bot.sent, "telegram_edits": bot.edits})
+    return fake
+
+
+SCENARIOS = {
+    "chunking": bench_chunking,
+    "summarize": bench_summarize,
+    "transcript": bench_transcript,
+    "pdf": bench_pdf,
+    "handlers": bench_handlers,
+}
+
+
+async def run_scenarios(args):
+    main.job_queue.start()
+    # Worker start-up and the lazily imported libraries are one-off costs of a running bot
+    # (prewarm() loads them right after startup), keep them out of the measurements
+    for module in main.PREWARM_MODULES: importlib.import_module(module)
+    if "pdf" in args.scenarios:
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(main.get_process_pool(), time.sleep, 0.1) for _ in range(main.pdf_workers)))
+    results = {}
+    try:
+        for name in args.scenarios:
+            scenario = Scenario(name)
+            tracemalloc.start()
+            started = time.perf_counter()
+            # The bot logs every stage, keep the report readable
+            with contextlib.redirect_stdout(io.StringIO()) if not args.verbose else contextlib.nullcontext():
+                fake = await SCENARIOS[name](args, scenario)
+            wall = time.perf_counter() - started
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            results[name] = scenario.report(wall, peak, fake)
+            print(f"{name:<11} " + "  ".join(f"{k}={v}" for k, v in results[name].items()))
+    finally:
+        await main.job_queue.stop()
+        if main.process_pool: main.process_pool.shutdown()
+    return results
+
+
+def compare(results, baseline_path, tolerance):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base: continue
+        for key in ("p50", "peak_mb", "gemini_calls"):
+            if key in base and base[key] and result.get(key, 0) > base[key] * (1 + tolerance):
+                regressions.append(f"{name}.{key}: {base[key]} -> {result[key]}")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks with fake Gemini and Telegram backends")
+    parser.add_argument("scenarios", nargs="*", help=f"any of: {', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument("--latency", type=float, default=0.2, help="fake Gemini base latency per call, seconds")
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0, help="share of fake Gemini calls answered with 429")
+    parser.add_argument("--text-chars", type=int, default=1_000_000)
+    parser.add_argument("--transcript-minutes", type=int, default=180)
+    parser.add_argument("--pdf-pages", type=int, default=300)
+    parser.add_argument("--chats", type=int, default=50, help="concurrent chats in the handlers scenario")
+    parser.add_argument("--handler-chars", type=int, default=20_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--compare", help="previous --json output to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--verbose", action="store_true", help="keep the bot's own log output")
+    args = parser.parse_args(argv)
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown: parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    if not args.scenarios: args.scenarios = list(SCENARIOS)
+    return args
+
+
+def run(argv=None):
+    args = parse_args(argv)
+    results = asyncio.run(run_scenarios(args))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        regressions = compare(results, args.compare, args.tolerance)
+        for line in regressions: print(f"REGRESSION {line}")
+        if regressions: sys.exit(1)
+
+
+if __name__ == "__main__":
+    run()
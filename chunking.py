@@ -0,0 +1,118 @@
+import re
+
+# Rough characters-per-token ratios for Gemini's tokenizer: Cyrillic words are split into
+# more tokens than Latin ones, CJK characters are close to one token each.
+CHARS_PER_TOKEN = 4.0
+CYRILLIC_CHARS_PER_TOKEN = 3.0
+CJK_CHARS_PER_TOKEN = 1.0
+
+CYRILLIC_RE = re.compile(r"[\u0400-\u04FF]+")
+CJK_RE = re.compile(r"[\u3040-\u30FF\u3400-\u4DBF\u4E00-\u9FFF\uAC00-\uD7AF]+")
+SENTENCE_END_RE = re.compile(r"(?<=[.!?…。！？])\s+")
+
+
+def estimate_tokens(text):
+    if not text: return 0
+    without_cyrillic = CYRILLIC_RE.sub('', text)
+    cyrillic = len(text) - len(without_cyrillic)
+    other = CJK_RE.sub('', without_cyrillic)
+    cjk = len(without_cyrillic) - len(other)
+    return int(len(other) / CHARS_PER_TOKEN + cyrillic / CYRILLIC_CHARS_PER_TOKEN + cjk / CJK_CHARS_PER_TOKEN) + 1
+
+
+def split_oversized(text, max_tokens):
+    """Split a paragraph that exceeds max_tokens at sentence boundaries, then at word
+    boundaries (transcripts often have no punctuation), then by characters as a last resort."""
+    pieces = []
+    for sentence in SENTENCE_END_RE.split(text):
+        if estimate_tokens(sentence) <= max_tokens:
+            pieces.append(sentence)
+            continue
+        words, size = [], 0
+        for word in sentence.split():
+            tokens = estimate_tokens(word) + 1
+            if tokens > max_tokens:
+                # A single "word" longer than the budget, e.g. a base64 blob
+                step = max(1, int(len(word) * max_tokens / tokens))
+                pieces.extend(word[i:i + step] for i in range(0, len(word), step))
+                continue
+            if words and size + tokens > max_tokens:
+                pieces.append(' '.join(words))
+                words, size = [], 0
+            words.append(word)
+            size += tokens
+        if words: pieces.append(' '.join(words))
+    return pieces
+
+
+class Chunker:
+    """Packs paragraphs into chunks of at most max_tokens estimated tokens.
+
+    Pieces are kept in a list and joined once per chunk. The last overlap_tokens worth of
+    pieces of each chunk are repeated at the start of the next one so context is not lost
+    at the boundary.
+    """
+
+    def __init__(self, max_tokens, overlap_tokens=0):
+        self.max_tokens = max(1, max_tokens)
+        self.overlap_tokens = min(overlap_tokens, self.max_tokens // 2)
+        self.pieces = []  # (separator, text, tokens)
+        self.size = 0
+        self.fresh = 0  # pieces added since the last emitted chunk
+
+    def feed(self, paragraph):
+        """Add one paragraph, returns the chunks completed by it"""
+        paragraph = paragraph.strip()
+        if not paragraph: return []
+        tokens = estimate_tokens(paragraph)
+        pieces = [paragraph] if tokens <= self.max_tokens else split_oversized(paragraph, self.max_tokens)
+        chunks = []
+        for i, piece in enumerate(pieces):
+            piece_tokens = tokens if len(pieces) == 1 else estimate_tokens(piece)
+            if self.size + piece_tokens > self.max_tokens:
+                if self.fresh: chunks.append(self._emit())
+                # Drop the carried overlap if it doesn't leave room for new content
+                if self.size + piece_tokens > self.max_tokens: self.pieces, self.size = [], 0
+            self.pieces.append(('\n' if i == 0 else ' ', piece, piece_tokens))
+            self.size += piece_tokens
+            self.fresh += 1
+        return chunks
+
+    def flush(self):
+        if not self.fresh: return None
+        chunk = self._emit()
+        self.pieces, self.size = [], 0
+        return chunk
+
+    def _emit(self):
+        chunk = ''.join(sep + text for sep, text, _ in self.pieces)[1:]
+        carried, carried_size = [], 0
+        for sep, text, tokens in reversed(self.pieces):
+            if carried_size + tokens > self.overlap_tokens: break
+            carried.append((sep, text, tokens))
+            carried_size += tokens
+        self.pieces = carried[::-1]
+        self.size = carried_size
+        self.fresh = 0
+        return chunk
+
+
+def iter_chunks(paragraphs, max_tokens, overlap_tokens=0):
+    chunker = Chunker(max_tokens, overlap_tokens)
+    for paragraph in paragraphs:
+        yield from chunker.feed(paragraph)
+    last = chunker.flush()
+    if last: yield last
+
+
+async def aiter_chunks(paragraphs, max_tokens, overlap_tokens=0):
+    """Same as iter_chunks() for a list or an async iterator of paragraphs"""
+    chunker = Chunker(max_tokens, overlap_tokens)
+    if hasattr(paragraphs, "__aiter__"):
+        async for paragraph in paragraphs:
+            for chunk in chunker.feed(paragraph): yield chunk
+    else:
+        for paragraph in paragraphs:
+            for chunk in chunker.feed(paragraph): yield chunk
+    last = chunker.flush()
+    if last: yield last
@@ -59,7 +59,7 @@ fi
 # 3. Test for errors using pyflakes
 echo "Testing code integrity..."
 # Capture output of pyflakes to send it to Telegram if it fails
-test_output=$(docker compose run --rm --no-deps --entrypoint "python -m pyflakes main.py" bot 2>&1)
+test_output=$(docker compose run --rm --no-deps --entrypoint "python -m pyflakes ." bot 2>&1)
 test_status=$?
 
 if [ $test_status -eq 0 ]; then
@@ -0,0 +1,85 @@
+import asyncio
+import base64
+import json
+import urllib.parse
+import httpx
+
+USER_AGENT = "Mozilla/5.0 (compatible; SummaryBot/1.0)"
+
+
+class ResponseTooLarge(Exception):
+    pass
+
+
+class HttpFetcher:
+    """Shared async HTTP client: keep-alive connection pool, per-host concurrency limits,
+    timeouts, response size caps and conditional requests backed by a page cache.
+
+    page_cache is any object with get(key)/set(key, value) and make_key(*parts), e.g. SummaryCache.
+    """
+
+    def __init__(self, timeout=15.0, max_bytes=5 * 1024 * 1024, per_host=4, max_connections=50, page_cache=None):
+        self.max_bytes = max_bytes
+        self.per_host = per_host
+        self.page_cache = page_cache
+        self.host_limits = {}
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(timeout),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections // 2),
+            follow_redirects=True,
+            headers={"User-Agent": USER_AGENT},
+        )
+
+    def _host_limit(self, url):
+        host = urllib.parse.urlsplit(url).hostname or ""
+        if host not in self.host_limits: self.host_limits[host] = asyncio.Semaphore(self.per_host)
+        return self.host_limits[host]
+
+    async def _read_capped(self, response):
+        declared = response.headers.get("content-length")
+        if declared and declared.isdigit() and int(declared) > self.max_bytes:
+            raise ResponseTooLarge(f"{declared} bytes")
+        body = bytearray()
+        async for part in response.aiter_bytes():
+            body += part
+            if len(body) > self.max_bytes: raise ResponseTooLarge(f">{self.max_bytes} bytes")
+        return bytes(body)
+
+    async def fetch_page(self, url):
+        """GET a page as raw bytes, leaving the charset to the HTML parser: headers often
+        omit it and the page declares it in <meta>. Revalidates cached copies with
+        ETag/Last-Modified so unchanged pages are not downloaded again."""
+        cache_key = self.page_cache.make_key("page", url) if self.page_cache else None
+        cached = None
+        if cache_key:
+            stored = self.page_cache.get(cache_key)
+            if stored: cached = json.loads(stored)
+            # Entries from before pages were kept as bytes
+            if cached and "content" not in cached: cached = None
+
+        headers = {}
+        if cached and cached.get("etag"): headers["If-None-Match"] = cached["etag"]
+        if cached and cached.get("last_modified"): headers["If-Modified-Since"] = cached["last_modified"]
+
+        async with self._host_limit(url):
+            async with self.client.stream("GET", url, headers=headers) as response:
+                if response.status_code == 304 and cached:
+                    return base64.b64decode(cached["content"])
+                response.raise_for_status()
+                body = await self._read_capped(response)
+                etag = response.headers.get("etag")
+                last_modified = response.headers.get("last-modified")
+
+        if cache_key and (etag or last_modified):
+            content = base64.b64encode(body).decode("ascii")
+            self.page_cache.set(cache_key, json.dumps({"etag": etag, "last_modified": last_modified, "content": content}))
+        return body
+
+    async def get_json(self, url, params=None):
+        async with self._host_limit(url):
+            async with self.client.stream("GET", url, params=params) as response:
+                body = await self._read_capped(response)
+        return json.loads(body)
+
+    async def close(self):
+        await self.client.aclose()
@@ -0,0 +1,159 @@
+import asyncio
+from collections import deque
+
+LIGHT = "light"
+HEAVY = "heavy"
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, chat_id, lane, factory):
+        self.chat_id = chat_id
+        self.lane = lane
+        self.factory = factory
+        self.task = None
+
+
+class Lane:
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.running = 0
+        self.pending = {}  # chat_id -> deque of jobs
+        self.rotation = deque()  # chat_ids with pending jobs, in round-robin order
+
+    def depth(self):
+        return sum(len(jobs) for jobs in self.pending.values())
+
+    def position(self, chat_id):
+        """Place of the chat's last queued job in round-robin order, 1 is served next.
+        Every chat ahead in the rotation gets a turn per round, the ones after it one less."""
+        rounds = len(self.pending[chat_id])
+        rotation = list(self.rotation)
+        n = rotation.index(chat_id)
+        return (sum(min(len(self.pending[other]), rounds) for other in rotation[:n + 1])
+                + sum(min(len(self.pending[other]), rounds - 1) for other in rotation[n + 1:]))
+
+
+class FairJobQueue:
+    """Fair-share scheduler for summarization jobs.
+
+    Jobs are split into a light lane (short text, articles, photos) and a heavy lane
+    (PDF, audio, video, long transcripts), each with its own worker pool. Inside a lane
+    chats are served round-robin and no chat runs more than per_chat jobs at once, so a
+    single user sending ten videos cannot starve everyone else.
+    """
+
+    def __init__(self, light_workers=4, heavy_workers=2, per_chat=1, max_depth=50):
+        self.lanes = {LIGHT: Lane(LIGHT, light_workers), HEAVY: Lane(HEAVY, heavy_workers)}
+        self.per_chat = per_chat
+        self.max_depth = max_depth
+        self.running = {}  # chat_id -> set of running jobs
+        self.condition = None
+        self.workers = []
+        self.draining = False
+
+    def start(self):
+        self.condition = asyncio.Condition()
+        for lane in self.lanes.values():
+            for _ in range(lane.workers):
+                self.workers.append(asyncio.create_task(self._worker(lane)))
+
+    async def stop(self):
+        for worker in self.workers: worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+    async def drain(self, timeout):
+        """Stop starting queued jobs and wait for the running ones. False on timeout."""
+        async with self.condition:
+            self.draining = True
+            self.condition.notify_all()
+            try:
+                await asyncio.wait_for(self.condition.wait_for(lambda: self.in_flight() == 0), timeout)
+                return True
+            except asyncio.TimeoutError:
+                return False
+
+    def depth(self):
+        return sum(lane.depth() for lane in self.lanes.values())
+
+    def in_flight(self):
+        return sum(lane.running for lane in self.lanes.values())
+
+    async def submit(self, chat_id, lane_name, factory):
+        """Queue factory() to run on the given lane. Returns the job's position in its lane
+        (0 if it starts right away), raises QueueFull when the backlog limit is reached."""
+        if self.depth() >= self.max_depth: raise QueueFull()
+        lane = self.lanes[lane_name]
+        job = Job(chat_id, lane_name, factory)
+        async with self.condition:
+            if chat_id not in lane.pending:
+                lane.pending[chat_id] = deque()
+                lane.rotation.append(chat_id)
+            lane.pending[chat_id].append(job)
+            position = lane.position(chat_id)
+            # A free worker skips chats at their per_chat limit, so the job doesn't
+            # have to be first in the rotation to start right away
+            starts_now = (len(lane.pending[chat_id]) == 1 and lane.running < lane.workers
+                          and len(self.running.get(chat_id, ())) < self.per_chat)
+            self.condition.notify_all()
+        return 0 if starts_now else position
+
+    async def cancel(self, chat_id):
+        """Drop the chat's queued jobs and cancel its running ones. Returns how many were cancelled."""
+        cancelled = 0
+        async with self.condition:
+            for lane in self.lanes.values():
+                jobs = lane.pending.pop(chat_id, None)
+                if jobs:
+                    cancelled += len(jobs)
+                    lane.rotation.remove(chat_id)
+            for job in self.running.get(chat_id, ()):
+                if job.task and not job.task.done():
+                    job.task.cancel()
+                    cancelled += 1
+        return cancelled
+
+    def _next_job(self, lane):
+        if self.draining: return None
+        for _ in range(len(lane.rotation)):
+            chat_id = lane.rotation[0]
+            lane.rotation.rotate(-1)
+            if len(self.running.get(chat_id, ())) >= self.per_chat: continue
+            jobs = lane.pending[chat_id]
+            job = jobs.popleft()
+            if not jobs:
+                del lane.pending[chat_id]
+                lane.rotation.remove(chat_id)
+            return job
+        return None
+
+    async def _worker(self, lane):
+        while True:
+            async with self.condition:
+                job = self._next_job(lane)
+                while job is None:
+                    await self.condition.wait()
+                    job = self._next_job(lane)
+                lane.running += 1
+                self.running.setdefault(job.chat_id, set()).add(job)
+                job.task = asyncio.create_task(job.factory())
+            try:
+                await job.task
+            except asyncio.CancelledError:
+                # Re-raise when the worker itself is being stopped, not just the job
+                if asyncio.current_task().cancelling(): raise
+                print(f"Job cancelled for chat {job.chat_id}")
+            except Exception as e:
+                print(f"Job Error: {e}")
+            finally:
+                async with self.condition:
+                    lane.running -= 1
+                    jobs = self.running.get(job.chat_id)
+                    jobs.discard(job)
+                    if not jobs: del self.running[job.chat_id]
+                    self.condition.notify_all()
@@ -0,0 +1,110 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class JobJournal:
+    """On-disk record of accepted jobs and the chunk summaries they have completed.
+
+    A job stays in the journal from the moment it is queued until it has replied (or was
+    cancelled by the user), so whatever is left at startup was interrupted by a restart
+    and can be resumed; finished chunks are not sent to Gemini again.
+    """
+
+    def __init__(self, path, max_age=24 * 3600):
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory: os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, chat_id INTEGER NOT NULL, kind TEXT NOT NULL, payload TEXT NOT NULL, "
+            "stage TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, "
+            "created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            "job_id TEXT NOT NULL, digest TEXT NOT NULL, summary TEXT NOT NULL, "
+            "PRIMARY KEY (job_id, digest))"
+        )
+        self.conn.commit()
+
+    @staticmethod
+    def chunk_digest(chunk):
+        return hashlib.sha256(chunk.encode("utf-8")).hexdigest()
+
+    def add(self, job_id, chat_id, kind, payload):
+        """Record a queued job. Re-adding a resumed job only resets its stage: attempts and
+        created_at carry over, so claim_pending() can give up on it eventually."""
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO jobs (id, chat_id, kind, payload, stage, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, 'queued', ?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET stage = 'queued', updated_at = excluded.updated_at",
+                (job_id, chat_id, kind, json.dumps(payload, ensure_ascii=False), now, now)
+            )
+            self.conn.commit()
+
+    def set_stage(self, job_id, stage):
+        with self.lock:
+            self.conn.execute("UPDATE jobs SET stage = ?, updated_at = ? WHERE id = ?", (stage, time.time(), job_id))
+            self.conn.commit()
+
+    def save_chunk(self, job_id, chunk, summary):
+        # Keyed by the chunk text, so a job summarizing several documents (a batch) can't mix them up
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO chunks (job_id, digest, summary) VALUES (?, ?, ?)",
+                (job_id, self.chunk_digest(chunk), summary)
+            )
+            self.conn.execute("UPDATE jobs SET updated_at = ? WHERE id = ?", (time.time(), job_id))
+            self.conn.commit()
+
+    def completed_chunk(self, job_id, chunk):
+        with self.lock:
+            row = self.conn.execute("SELECT summary FROM chunks WHERE job_id = ? AND digest = ?",
+                                    (job_id, self.chunk_digest(chunk))).fetchone()
+        return row[0] if row else None
+
+    def finish(self, job_id):
+        with self.lock:
+            self.conn.execute("DELETE FROM chunks WHERE job_id = ?", (job_id,))
+            self.conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            self.conn.commit()
+
+    def finish_chat(self, chat_id):
+        with self.lock:
+            self.conn.execute("DELETE FROM chunks WHERE job_id IN (SELECT id FROM jobs WHERE chat_id = ?)", (chat_id,))
+            self.conn.execute("DELETE FROM jobs WHERE chat_id = ?", (chat_id,))
+            self.conn.commit()
+
+    def claim_pending(self, max_attempts=3, chat_filter=None, before=None):
+        """Interrupted jobs to resume, oldest first. Each call counts as an attempt, jobs that
+        keep failing across restarts or got too old are dropped.
+        chat_filter, if given, limits the claim to chats it returns True for; before (a
+        timestamp) leaves out jobs the current process accepted itself."""
+        now = time.time()
+        with self.lock:
+            stale = self.conn.execute("SELECT id, kind, attempts FROM jobs WHERE created_at < ? OR attempts >= ?",
+                                      (now - self.max_age, max_attempts)).fetchall()
+            for job_id, kind, attempts in stale:
+                print(f"Dropping interrupted {kind} job {job_id} after {attempts} attempts")
+                self.conn.execute("DELETE FROM chunks WHERE job_id = ?", (job_id,))
+                self.conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            rows = self.conn.execute(
+                "SELECT id, chat_id, kind, payload, stage FROM jobs WHERE created_at < ? ORDER BY created_at",
+                (before or now,)
+            ).fetchall()
+            jobs = []
+            for job_id, chat_id, kind, payload, stage in rows:
+                if chat_filter and not chat_filter(chat_id): continue
+                self.conn.execute("UPDATE jobs SET attempts = attempts + 1 WHERE id = ?", (job_id,))
+                jobs.append({"id": job_id, "chat_id": chat_id, "kind": kind, "payload": json.loads(payload), "stage": stage})
+            self.conn.commit()
+        return jobs
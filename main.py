@@ -1,56 +1,286 @@
 import asyncio
+import contextvars
+import importlib
+import json
 import os
 import re
+import threading
 import time
 import urllib.parse
-import requests
-import trafilatura
+from collections import OrderedDict
+from functools import partial
+from types import SimpleNamespace
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from google import genai
-from google.genai import types
-from PyPDF2 import PdfReader
-from tqdm import tqdm
+# Reference point of the startup report, taken before the third-party imports.
+# google-genai, trafilatura, PyPDF2, youtube_transcript_api and tqdm are slow to import
+# and are loaded on first use (or by prewarm() once the bot is up).
+process_started = time.perf_counter()
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
-from telegram.ext import CommandHandler, MessageHandler, CallbackQueryHandler, filters, ApplicationBuilder, ContextTypes
-from youtube_transcript_api import YouTubeTranscriptApi
+from telegram.ext import (CommandHandler, MessageHandler, CallbackQueryHandler, TypeHandler, filters, ApplicationBuilder,
+                          ContextTypes)
+from cache import SummaryCache
+from chunking import aiter_chunks, estimate_tokens, iter_chunks
+from pdf_extract import iter_pdf_pages
+from progressive import ProgressiveReply, split_message
+from http_fetch import HttpFetcher
+from youtube_transcripts import extract_video_id, fetch_segments, segments_to_paragraphs
+from retrieval import BM25Index
+from batch import build_packed_prompt, format_item, pack_items, parse_batch_items, parse_packed_summaries
+from metrics import (CACHE_REQUESTS, GEMINI_BACKOFF_SECONDS, GEMINI_CALL_SECONDS, GEMINI_FALLBACKS, GEMINI_IN_FLIGHT,
+                     GEMINI_LIMITER_WAIT_SECONDS, GEMINI_RATE_LIMITED, GEMINI_RETRIES, JOBS_IN_FLIGHT,
+                     QUEUE_DEPTH, STAGE_SECONDS, STARTUP_SECONDS, log_event, new_request_id, record_usage, set_request_id,
+                     stage, start_metrics_server, request_id_var)
+from jobqueue import FairJobQueue, QueueFull, LIGHT, HEAVY
+from ratelimit import RateLimiter, backoff_delay, parse_retry_after
+from routing import ModelRouter, parse_routes
+from journal import JobJournal
 
 # --- CONFIGURATION ---
 telegram_token = os.environ.get("TELEGRAM_TOKEN", "xxx")
 model_name = os.environ.get("LLM_MODEL", "gemini-flash-latest") 
+# Per call site / input size overrides of LLM_MODEL, see routing.parse_routes
+model_routes = os.environ.get("MODEL_ROUTES", "map=gemini-flash-lite-latest,keywords=gemini-flash-lite-latest,*<2000=gemini-flash-lite-latest")
+fallback_model = os.environ.get("FALLBACK_MODEL", "gemini-flash-lite-latest")
 lang = os.environ.get("TS_LANG", "Russian") 
 chunk_size = int(os.environ.get("CHUNK_SIZE", 100000))
+# Chunks are budgeted in estimated tokens. The default is a token budget per map call, not
+# the English equivalent of CHUNK_SIZE: Russian text runs ~3 chars per token, so a
+# CHUNK_SIZE // 4 budget would cut its chunks to ~75k characters and add calls.
+# 32k tokens is ~100k characters of Russian and ~128k of English, a small share of the
+# ~1M-token context of the Flash models that keeps map calls fast and parallel.
+chunk_tokens = int(os.environ.get("CHUNK_TOKENS", 32000))
+chunk_overlap_tokens = int(os.environ.get("CHUNK_OVERLAP_TOKENS", 200))
+max_parallel_chunks = max(1, int(os.environ.get("MAX_PARALLEL_CHUNKS", 4)))
 allowed_users = os.environ.get("ALLOWED_USERS", "")
 google_api_key = os.environ.get("GOOGLE_API_KEY", "")
 google_cse_id = os.environ.get("GOOGLE_CSE_ID", "")
+cache_path = os.environ.get("CACHE_PATH", "data/summary_cache.sqlite3")
+cache_ttl = int(os.environ.get("CACHE_TTL", 7 * 24 * 3600))
+cache_max_entries = int(os.environ.get("CACHE_MAX_ENTRIES", 5000))
+gemini_rpm = int(os.environ.get("GEMINI_RPM", 60))
+gemini_tpm = int(os.environ.get("GEMINI_TPM", 1000000))
+gemini_retries = int(os.environ.get("GEMINI_RETRIES", 5))
+light_workers = int(os.environ.get("LIGHT_WORKERS", 4))
+heavy_workers = int(os.environ.get("HEAVY_WORKERS", 2))
+max_jobs_per_chat = int(os.environ.get("MAX_JOBS_PER_CHAT", 1))
+max_queue_depth = int(os.environ.get("MAX_QUEUE_DEPTH", 50))
+pdf_workers = int(os.environ.get("PDF_WORKERS", os.cpu_count() or 2))
+max_file_size_mb = int(os.environ.get("MAX_FILE_SIZE_MB", 20))
+inline_media_max_mb = float(os.environ.get("INLINE_MEDIA_MAX_MB", 4))
+gemini_files_path = os.environ.get("GEMINI_FILES_CACHE_PATH", "data/gemini_files.sqlite3")
+telegram_base_url = os.environ.get("TELEGRAM_BASE_URL", "")
+telegram_base_file_url = os.environ.get("TELEGRAM_BASE_FILE_URL", "")
+telegram_local_mode = os.environ.get("TELEGRAM_LOCAL_MODE", "0") == "1"
+webhook_url = os.environ.get("WEBHOOK_URL", "")
+webhook_path = os.environ.get("WEBHOOK_PATH", "telegram").strip("/")
+webhook_listen = os.environ.get("WEBHOOK_LISTEN", "0.0.0.0")
+webhook_port = int(os.environ.get("WEBHOOK_PORT", 8443))
+webhook_secret = os.environ.get("WEBHOOK_SECRET", "")
+webhook_workers = int(os.environ.get("WEBHOOK_WORKERS", 1))
+metrics_port = int(os.environ.get("METRICS_PORT", 9464))
+metrics_addr = os.environ.get("METRICS_ADDR", "127.0.0.1")
+http_timeout = float(os.environ.get("HTTP_TIMEOUT", 15))
+http_per_host = int(os.environ.get("HTTP_PER_HOST", 4))
+max_page_mb = float(os.environ.get("MAX_PAGE_MB", 5))
+page_cache_path = os.environ.get("PAGE_CACHE_PATH", "data/pages.sqlite3")
+page_cache_ttl = int(os.environ.get("PAGE_CACHE_TTL", 24 * 3600))
+yt_languages = [l.strip() for l in os.environ.get("YT_LANGS", "ru,en").split(",") if l.strip()]
+transcript_cache_path = os.environ.get("TRANSCRIPT_CACHE_PATH", "data/transcripts.sqlite3")
+progressive_replies = os.environ.get("PROGRESSIVE_REPLIES", "1") == "1"
+prewarm_enabled = os.environ.get("PREWARM", "1") == "1"
+progress_edit_interval = float(os.environ.get("PROGRESS_EDIT_INTERVAL", 1.5))
+batch_max_items = int(os.environ.get("BATCH_MAX_ITEMS", 50))
+batch_concurrency = int(os.environ.get("BATCH_CONCURRENCY", 8))
+context_cache_path = os.environ.get("CONTEXT_CACHE_PATH", "data/context_caches.sqlite3")
+context_cache_ttl = int(os.environ.get("CONTEXT_CACHE_TTL", 3600))
+context_cache_min_tokens = int(os.environ.get("CONTEXT_CACHE_MIN_TOKENS", 4096))
+doc_store_path = os.environ.get("DOC_STORE_PATH", "data/documents.sqlite3")
+doc_store_ttl = int(os.environ.get("DOC_STORE_TTL", 3 * 24 * 3600))
+doc_store_max_entries = int(os.environ.get("DOC_STORE_MAX_ENTRIES", 1000))
+search_cache_ttl = int(os.environ.get("SEARCH_CACHE_TTL", 24 * 3600))
+journal_path = os.environ.get("JOURNAL_PATH", "data/journal.sqlite3")
+drain_timeout = float(os.environ.get("DRAIN_TIMEOUT", 90))
+qa_top_k = int(os.environ.get("QA_TOP_K", 4))
+qa_passage_tokens = int(os.environ.get("QA_PASSAGE_TOKENS", 600))
+
+# Bump whenever the prompts change so cached summaries made with old prompts are not reused
+PROMPT_VERSION = 1
 
 client = None
-if google_api_key:
-    client = genai.Client(api_key=google_api_key)
+client_lock = threading.Lock()
+
+def get_gemini_client():
+    """The genai client, created on first use. None without GOOGLE_API_KEY."""
+    global client
+    if client is None and google_api_key:
+        # prewarm() may be creating it in its thread at the same time
+        with client_lock:
+            if client is None:
+                from google import genai
+                client = genai.Client(api_key=google_api_key)
+    return client
+
+router = ModelRouter(model_name, parse_routes(model_routes), fallback_model or None)
+
+# Every Gemini call in the process draws from one GEMINI_RPM/GEMINI_TPM budget,
+# whichever model it goes to.
+gemini_limiter = RateLimiter(rpm=gemini_rpm, tpm=gemini_tpm)
+# A 429 only says when that model may be called again, so each model gets its own
+# (budget-less) limiter to hold the pause; the fallback model keeps going meanwhile.
+gemini_limiters = {}
+
+def limiter_for(model):
+    if model not in gemini_limiters: gemini_limiters[model] = RateLimiter()
+    return gemini_limiters[model]
+
+job_queue = FairJobQueue(light_workers=light_workers, heavy_workers=heavy_workers,
+                         per_chat=max_jobs_per_chat, max_depth=max_queue_depth)
+for lane_name, lane in job_queue.lanes.items():
+    QUEUE_DEPTH.labels(lane_name).set_function(lane.depth)
+    JOBS_IN_FLIGHT.labels(lane_name).set_function(lambda lane=lane: lane.running)
+
+# PDF pages and web pages are parsed in worker processes. Created on first use
+# so idle bots don't keep them around.
+process_pool = None
+
+# Imported by each worker process as it starts, the bot process itself doesn't need them
+EXTRACTOR_MODULES = ("trafilatura", "PyPDF2")
+
+def load_extractors():
+    for module in EXTRACTOR_MODULES: importlib.import_module(module)
+
+def get_process_pool():
+    global process_pool
+    if process_pool is None: process_pool = ProcessPoolExecutor(max_workers=pdf_workers, initializer=load_extractors)
+    return process_pool
+
+http_fetcher = None
+
+def get_http_fetcher():
+    global http_fetcher
+    if http_fetcher is None:
+        page_cache = None
+        if page_cache_path:
+            page_cache = SummaryCache(page_cache_path, max_entries=cache_max_entries, ttl=page_cache_ttl)
+        http_fetcher = HttpFetcher(timeout=http_timeout, max_bytes=int(max_page_mb * 1024 * 1024),
+                                   per_host=http_per_host, page_cache=page_cache)
+    return http_fetcher
+
+# Uploads to the Gemini Files API live for 48h; remember them a bit less than that
+GEMINI_FILE_TTL = 46 * 3600
+gemini_files = None
+if gemini_files_path:
+    gemini_files = SummaryCache(gemini_files_path, max_entries=cache_max_entries, ttl=GEMINI_FILE_TTL)
+
+transcript_cache = None
+if transcript_cache_path:
+    transcript_cache = SummaryCache(transcript_cache_path, max_entries=cache_max_entries, ttl=cache_ttl)
+
+summary_cache = None
+if cache_path:
+    summary_cache = SummaryCache(cache_path, max_entries=cache_max_entries, ttl=cache_ttl)
+
+# What went into each bot reply (source, chunks, summaries, keywords), keyed by chat and
+# message ID so the buttons under a reply can reuse it. Search results are memoized by query.
+documents = None
+search_cache = None
+if doc_store_path:
+    documents = SummaryCache(doc_store_path, max_entries=doc_store_max_entries, ttl=doc_store_ttl, table="documents")
+    search_cache = SummaryCache(doc_store_path, max_entries=cache_max_entries, ttl=search_cache_ttl, table="searches")
+
+# Accepted jobs and their finished chunk summaries, so a restart resumes instead of starting over
+journal = None
+if journal_path:
+    journal = JobJournal(journal_path)
+# Journal ID of the job the current task runs for, set by enqueue_job()
+journal_job_var = contextvars.ContextVar("journal_job", default=None)
+# Placeholder of the job the current task runs for, cleared by enqueue_job() on /cancel
+progressive_reply_var = contextvars.ContextVar("progressive_reply", default=None)
+# Set on shutdown: jobs cancelled from now on are interrupted, not abandoned
+draining = False
+
+# Names of Gemini cached contexts, forgotten a minute before Gemini expires them
+context_caches = None
+if context_cache_path and context_cache_ttl:
+    context_caches = SummaryCache(context_cache_path, max_entries=cache_max_entries, ttl=max(60, context_cache_ttl - 60))
 
 # --- HELPER FUNCTIONS ---
 
-def print_available_models():
-    if not client: return
+async def print_available_models():
+    """Print the Gemini models and return all model names, None when the listing failed"""
+    if not get_gemini_client(): return None
     print("\n🔍 CHECKING AVAILABLE MODELS...")
     try:
         count = 0
-        for m in client.models.list():
+        names = []
+        async for m in await get_gemini_client().aio.models.list():
+            names.append(m.name)
             if ("gemini" in m.name or "gemma" in m.name) and "vision" not in m.name:
                 print(f" • {m.name}")
                 count += 1
         print(f"✅ Total: {count}\n👉 Selected: {model_name}\n")
+        return names
     except Exception as e:
         print(f"❌ Error listing models: {e}")
+        return None
+
+def validate_model_routes(available):
+    if not available: return
+    dropped = router.validate(available)
+    if dropped: print(f"⚠️ Unknown models in MODEL_ROUTES/FALLBACK_MODEL, using {model_name} instead: {', '.join(dropped)}")
+    routes = ', '.join(f"{r.site}{f'<{r.max_tokens}' if r.max_tokens else ''}={r.model}" for r in router.routes)
+    print(f"🔀 Model routes: {routes or '-'}; fallback: {router.fallback or '-'}")
+
+def summary_cache_key(source, target_lang=None):
+    return SummaryCache.make_key(PROMPT_VERSION, model_name, target_lang or lang, source)
+
+def normalize_user_input(user_input):
+    text = user_input.strip()
+    video_id = extract_video_id(text)
+    if video_id: return "youtube:" + video_id
+    if re.match(r"https?://\S+$", text):
+        return "url:" + urllib.parse.urldefrag(text)[0]
+    return "text:" + ' '.join(text.split())
+
+def is_error_result(text):
+    """Error strings returned by the Gemini helpers, these must never end up in the cache"""
+    if not text: return True
+    return text.startswith(("Error", "Ошибка", "API Key Error", "Модель вернула пустой ответ", "Превышены лимиты"))
+
+def get_cached_summary(key):
+    if not summary_cache: return None
+    try:
+        cached = summary_cache.get(key)
+        CACHE_REQUESTS.labels("summary", "hit" if cached else "miss").inc()
+        return cached
+    except Exception as e:
+        print(f"Cache Error: {e}")
+        return None
+
+def store_cached_summary(key, summary):
+    if not summary_cache or is_error_result(summary): return
+    try:
+        summary_cache.set(key, summary)
+    except Exception as e:
+        print(f"Cache Error: {e}")
 
 def split_user_input(text):
     paragraphs = text.split('\n')
     paragraphs = [paragraph.strip() for paragraph in paragraphs if paragraph.strip()]
     return paragraphs
 
-def scrape_text_from_url(url):
+def extract_article(html):
+    """Runs in a worker process, which imports trafilatura on first use. html is the raw
+    page: trafilatura detects the encoding, including <meta charset>."""
+    import trafilatura
+    return trafilatura.extract(html, include_formatting=True)
+
+async def scrape_text_from_url(url):
     try:
-        downloaded = trafilatura.fetch_url(url)
-        text = trafilatura.extract(downloaded, include_formatting=True)
+        downloaded = await get_http_fetcher().fetch_page(url)
+        loop = asyncio.get_running_loop()
+        text = await loop.run_in_executor(get_process_pool(), extract_article, downloaded)
         if text is None: return []
         return [text]
     except Exception as e:
@@ -63,6 +293,12 @@ async def search_results(keywords):
         print("❌ Ошибка: Не задан GOOGLE_CSE_ID")
         return []
     
+    cache_key = SummaryCache.make_key("search", keywords.lower())
+    if search_cache:
+        cached = search_cache.get(cache_key)
+        CACHE_REQUESTS.labels("search", "hit" if cached else "miss").inc()
+        if cached: return json.loads(cached)
+
     print(f"🔎 Google Searching: {keywords}")
     url = "https://www.googleapis.com/customsearch/v1"
     params = {
@@ -73,9 +309,7 @@ async def search_results(keywords):
     }
     
     try:
-        loop = asyncio.get_running_loop()
-        response = await loop.run_in_executor(None, lambda: requests.get(url, params=params))
-        data = response.json()
+        data = await get_http_fetcher().get_json(url, params=params)
         
         if 'error' in data:
             err_msg = data['error']['message']
@@ -89,6 +323,7 @@ async def search_results(keywords):
                     'title': item.get('title'),
                     'href': item.get('link')
                 })
+        if search_cache and results: search_cache.set(cache_key, json.dumps(results, ensure_ascii=False))
         return results
         
     except Exception as e:
@@ -109,69 +344,155 @@ def strip_content_type_label(text):
             lines = lines[1:]
     return '\n'.join(lines)
 
-def summarize(text_array, target_lang=None):
-    if target_lang is None: target_lang = lang
-    def create_chunks(paragraphs):
-        chunks = []
-        chunk = ''
-        for paragraph in paragraphs:
-            if len(chunk) + len(paragraph) < chunk_size:
-                chunk += paragraph + ' '
-            else:
-                chunks.append(chunk.strip())
-                chunk = paragraph + ' '
-        if chunk: chunks.append(chunk.strip())
-        return chunks
+def batch_summaries(summaries):
+    """Group partial summaries into batches whose combined length fits in one chunk.
+    Every batch gets at least two items (when available) so each reduce level shrinks the list."""
+    batches = []
+    batch, batch_len = [], 0
+    for summary in summaries:
+        if len(batch) >= 2 and batch_len + len(summary) > chunk_size:
+            batches.append(batch)
+            batch, batch_len = [], 0
+        batch.append(summary)
+        batch_len += len(summary) + 1
+    if batch:
+        # Don't leave a lone trailing summary for another round if it can join the previous batch
+        if len(batch) == 1 and batches: batches[-1].append(batch[0])
+        else: batches.append(batch)
+    return batches
 
+def text_system_instruction(target_lang):
+    current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    return (
+        f"You are an expert content analyst. Respond in {target_lang}. "
+        f"Current date and time: {current_time}. "
+        "Extract the key information from the content and present it clearly. "
+        "For lectures or educational material: list all rules, definitions, formulas, exceptions, and examples as a numbered list. "
+        "For news or articles: give a concise factual summary. "
+        "For other content: summarize the main points. "
+        "CRITICAL: Your response MUST start directly with the content (a number, a word, a sentence). "
+        "Do NOT write any heading, label, title, or category name at the start. "
+        "Write in PLAIN TEXT ONLY. No Markdown, no bold (**), no italics (*), no headers (#), no links []. "
+        "Do NOT use LaTeX or dollar signs ($). "
+    )
+
+async def summarize(text_array, target_lang=None, on_progress=None, record=None):
+    """on_progress, if given, is called with partial results: chunk summaries as they
+    complete, then the final summary while it is being streamed.
+
+    record, a dict, receives the chunk summaries for the document store. The chunks themselves
+    are not kept: questions re-read the source (source_text()), so a long PDF never has to be
+    held in memory whole."""
+    if target_lang is None: target_lang = lang
     try:
-        if isinstance(text_array, list) and len(text_array) == 1 and len(text_array[0]) < chunk_size:
-            text_chunks = text_array
-        else:
-            flat_text = "\n".join(text_array)
-            if len(flat_text) < chunk_size: text_chunks = [flat_text]
-            else: text_chunks = create_chunks(text_array)
-
-        summaries = []
-        current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        system_instruction = (
-            f"You are an expert content analyst. Respond in {target_lang}. "
-            f"Current date and time: {current_time}. "
-            "Extract the key information from the content and present it clearly. "
-            "For lectures or educational material: list all rules, definitions, formulas, exceptions, and examples as a numbered list. "
-            "For news or articles: give a concise factual summary. "
-            "For other content: summarize the main points. "
-            "CRITICAL: Your response MUST start directly with the content (a number, a word, a sentence). "
-            "Do NOT write any heading, label, title, or category name at the start. "
-            "Write in PLAIN TEXT ONLY. No Markdown, no bold (**), no italics (*), no headers (#), no links []. "
-            "Do NOT use LaTeX or dollar signs ($). "
-        )
-        for i, chunk in enumerate(tqdm(text_chunks, desc="Summarizing")):
-            if not chunk.strip(): continue
+        system_instruction = text_system_instruction(target_lang)
+        # Bounds the number of in-flight Gemini requests for this document
+        semaphore = asyncio.Semaphore(max_parallel_chunks)
+        from tqdm import tqdm
+        progress = tqdm(desc="Summarizing")
+
+        done = {}
+        job_id = journal_job_var.get() if journal else None
+        resumed = 0
+
+        def stream_final(text):
+            on_progress(strip_content_type_label(text))
+
+        def report_chunks():
+            # Show the completed prefix so partial results always read in document order
+            ready = []
+            while len(ready) in done: ready.append(done[len(ready)])
+            if ready: on_progress(f"⏳ Готово частей: {len(done)}\n\n" + '\n\n'.join(ready))
+
+        async def summarize_chunk(index, chunk, is_only):
+            nonlocal resumed
             prompt = (
                 f"Extract and present the key information from the following content:\n{chunk}"
             )
-            result = call_gemini_with_retry(prompt, system_instruction)
-            if result: summaries.append(strip_content_type_label(result))
-            if i < len(text_chunks) - 1: time.sleep(2)
+            try:
+                on_text = stream_final if on_progress and is_only else None
+                # Chunks finished before a restart come from the journal
+                saved = journal.completed_chunk(job_id, chunk) if job_id and not is_only else None
+                if saved:
+                    result = saved
+                    resumed += 1
+                else:
+                    model = router.route("summary" if is_only else "map", estimate_tokens(chunk))
+                    result = await call_gemini_with_retry(prompt, system_instruction, on_text=on_text, model=model)
+                    if job_id and not is_only and not is_error_result(result): journal.save_chunk(job_id, chunk, result)
+            finally:
+                semaphore.release()
+            progress.update(1)
+            if on_progress and not is_only and result:
+                done[index] = strip_content_type_label(result)
+                report_chunks()
+            return result
 
-        if not summaries: return "Ошибка: пустой ответ."
-        if len(summaries) == 1: return strip_content_type_label(summaries[0])
-        
-        summary = ' '.join(summaries)
-        final_prompt = f"Combine these points into a final summary in {target_lang}:\n{summary}"
-        result = call_gemini_with_retry(final_prompt, system_instruction)
-        return strip_content_type_label(result)
+        async def combine_batch(batch, is_final):
+            if len(batch) == 1: return batch[0]
+            prompt = f"Combine these points into a final summary in {target_lang}:\n{' '.join(batch)}"
+            on_text = stream_final if on_progress and is_final else None
+            async with semaphore:
+                model = router.route("reduce", estimate_tokens(prompt))
+                return strip_content_type_label(await call_gemini_with_retry(prompt, system_instruction, on_text=on_text, model=model))
+
+        # Map stage: each chunk is sent as soon as it is assembled, so summarizing starts
+        # while the input is still being read. Waiting for the semaphore before reading on
+        # keeps at most max_parallel_chunks chunks in memory. Results stay in chunk order.
+        # Each chunk is held back until the next one exists, so a single-chunk
+        # document is known in time to stream its summary directly.
+        tasks = []
+        map_started = time.perf_counter()
+        try:
+            held = None
+            async for chunk in aiter_chunks(text_array, chunk_tokens, chunk_overlap_tokens):
+                if not chunk.strip(): continue
+                if held is not None:
+                    await semaphore.acquire()
+                    tasks.append(asyncio.create_task(summarize_chunk(len(tasks), held, False)))
+                held = chunk
+            if held is not None:
+                await semaphore.acquire()
+                tasks.append(asyncio.create_task(summarize_chunk(len(tasks), held, not tasks)))
+            results = await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks: task.cancel()
+            raise
+        finally:
+            progress.close()
+        STAGE_SECONDS.labels("summarize", "map").observe(time.perf_counter() - map_started)
+        log_event("summarize_map", chunks=len(tasks), resumed=resumed, seconds=round(time.perf_counter() - map_started, 3))
+        # A summary missing a part must not look complete: it would be cached and stored
+        failed = sum(1 for r in results if is_error_result(r))
+        if len(results) == 1 and failed: return results[0] or "Ошибка: пустой ответ."
+        if failed: return f"Ошибка: не удалось обработать {failed} из {len(results)} частей, попробуйте ещё раз."
+        summaries = [strip_content_type_label(r) for r in results]
+        if record is not None: record["chunk_summaries"] = summaries
+
+        # Reduce stage: combine batches of partial summaries level by level until one is left
+        if job_id and len(summaries) > 1: journal.set_stage(job_id, "reduce")
+        level = 0
+        while len(summaries) > 1:
+            level += 1
+            batches = batch_summaries(summaries)
+            print(f"Reduce level {level}: {len(summaries)} summaries -> {len(batches)} batches")
+            is_final = len(batches) == 1
+            with stage("summarize", "reduce"):
+                summaries = await asyncio.gather(*(combine_batch(b, is_final) for b in batches))
+            if any(is_error_result(r) for r in summaries):
+                # A single failed combine (e.g. a stream cut off) carries its own message
+                if len(summaries) == 1 and summaries[0]: return summaries[0]
+                return "Ошибка: не удалось объединить части, попробуйте ещё раз."
+
+        return strip_content_type_label(summaries[0])
 
     except Exception as e:
         print(f"Summarize Error: {e}")
         return f"Error: {e}"
 
-def analyze_media(file_bytes, mime_type, prompt_text="Summarize this.", target_lang=None):
-    if target_lang is None: target_lang = lang
-    if not client: return "API Key Error"
-
+def media_system_instruction(target_lang):
     current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    system_instruction = (
+    return (
         f"You are an expert content analyst. Analyze the provided media. Respond in {target_lang}. "
         f"Current date and time: {current_time}. "
         "Extract the key information from the content and present it clearly. "
@@ -183,124 +504,597 @@ def analyze_media(file_bytes, mime_type, prompt_text="Summarize this.", target_l
         "Write in PLAIN TEXT ONLY. No Markdown, no bold (**), no italics (*), no headers (#), no links []. "
         "Do NOT use LaTeX or dollar signs ($). "
     )
-    try:
-        config = types.GenerateContentConfig(system_instruction=system_instruction, temperature=0.3)
-        response = client.models.generate_content(
-            model=model_name,
-            contents=[types.Part.from_bytes(data=file_bytes, mime_type=mime_type), prompt_text],
-            config=config
-        )
-        if response.text: return strip_content_type_label(response.text.strip())
-        return "Модель вернула пустой ответ."
-    except Exception as e:
-        if "429" in str(e): return "Превышены лимиты API (429)."
-        print(f"Media Error: {e}")
-        return f"Ошибка обработки медиа: {e}"
 
-def call_gemini_with_retry(prompt, system_instruction, retries=3):
+MEDIA_ERROR = "Ошибка обработки медиа"
+
+async def analyze_media(media_part, prompt_text="Summarize this.", target_lang=None, media_tokens=None, record=None,
+                        instruction=media_system_instruction, site="media", cache_source=None):
+    """media_part is a types.Part built by load_media_part(): inline bytes or a Files API reference.
+
+    media_tokens is the estimated size of the media (estimate_media_tokens()). record, a dict,
+    receives the Files API handle and the media's actual token count, so follow-up questions
+    can go to the file itself. instruction builds the system instruction for a language.
+    cache_source, given for follow-ups, keeps an uploaded file in a Gemini cached context
+    under that source: the next question about it is billed at the cached-token rate."""
+    from google.genai import types
+    if target_lang is None: target_lang = lang
+    if not get_gemini_client(): return "API Key Error"
+
+    system_instruction = instruction(target_lang)
+    if media_tokens is None: media_tokens = MEDIA_TOKEN_ESTIMATE
+    prompt_tokens = estimate_tokens(system_instruction + prompt_text)
+    # The limiter corrects the estimate from usage_metadata afterwards
+    estimated_tokens = prompt_tokens + media_tokens
+    model = router.route(site, estimated_tokens)
+    cached_name = None
+    if cache_source and media_part.file_data:
+        cached_name = await get_context_cache(cache_source, [media_part], instruction(CACHED_LANGUAGE),
+                                              media_tokens, model, display_name=site)
+    for attempt in range(gemini_retries):
+        if cached_name:
+            config = types.GenerateContentConfig(cached_content=cached_name, temperature=0.3)
+            contents = [f"{prompt_text}\nRespond in {target_lang}."]
+        else:
+            config = types.GenerateContentConfig(system_instruction=system_instruction, temperature=0.3)
+            contents = [media_part, prompt_text]
+        try:
+            response = await generate_content(contents, config, estimated_tokens, kind=site, model=model)
+            if not response.text: return "Модель вернула пустой ответ."
+            if record is not None and media_part.file_data:
+                # What Gemini billed for the prompt, less our estimate of its text part
+                usage = getattr(response, "usage_metadata", None)
+                measured = (getattr(usage, "prompt_token_count", None) or 0) - prompt_tokens
+                record["media"] = {"uri": media_part.file_data.file_uri, "mime_type": media_part.file_data.mime_type,
+                                   "tokens": measured if measured > 0 else media_tokens}
+            return strip_content_type_label(response.text.strip())
+        except Exception as e:
+            if is_rate_limit_error(e):
+                fallback = router.fallback_for(model)
+                if fallback and not cached_name:
+                    report_fallback(model, fallback)
+                    model = fallback
+                    continue
+                await backoff(attempt, site)
+                continue
+            if cached_name:
+                print(f"Cached context failed, sending the media inline: {e}")
+                forget_context_cache(cache_source, model)
+                cached_name = None
+                continue
+            print(f"Media Error: {e}")
+            return f"{MEDIA_ERROR}: {e}"
+    return "Превышены лимиты API (429)."
+
+async def call_gemini_with_retry(prompt, system_instruction, retries=None, on_text=None, model=None):
+    if retries is None: retries = gemini_retries
+    if model is None: model = model_name
     for attempt in range(retries):
-        res = call_gemini_api(prompt, system_instruction)
+        res = await call_gemini_api(prompt, system_instruction, on_text=on_text, model=model)
         if res == "429":
-            time.sleep((attempt + 1) * 5)
+            # Switch to the fallback model right away instead of sleeping
+            fallback = router.fallback_for(model)
+            if fallback:
+                report_fallback(model, fallback)
+                model = fallback
+                continue
+            await backoff(attempt, "text")
             continue
         return res
     return "Error: Quota exceeded."
 
-def call_gemini_api(prompt, system_instruction=None):
-    if not client: return "API Key Error"
+async def call_gemini_api(prompt, system_instruction=None, on_text=None, model=None):
+    """on_text, if given, switches to a streaming request and receives the text generated so far.
+    model defaults to LLM_MODEL."""
+    from google.genai import types
+    if not get_gemini_client(): return "API Key Error"
     try:
         config = types.GenerateContentConfig(system_instruction=system_instruction, temperature=0.3)
-        response = client.models.generate_content(
-            model=model_name, contents=prompt, config=config
-        )
+        estimated_tokens = estimate_tokens(prompt) + estimate_tokens(system_instruction or "")
+        if on_text: return (await generate_content_stream(prompt, config, estimated_tokens, on_text, model=model)).strip()
+        response = await generate_content(prompt, config, estimated_tokens, model=model)
         if response.text: return response.text.strip()
         return ""
     except Exception as e:
-        if "429" in str(e) or "RESOURCE_EXHAUSTED" in str(e): return "429"
+        if is_rate_limit_error(e): return "429"
         print(f"Gemini API Error: {e}")
         return ""
 
-# --- YOUTUBE & FILES ---
+# Budget for media of unknown length; this is only the initial reservation
+MEDIA_TOKEN_ESTIMATE = 2000
+# Gemini's per-item and per-second token rates for media
+IMAGE_TOKENS = 258
+AUDIO_TOKENS_PER_SECOND = 32
+VIDEO_TOKENS_PER_SECOND = 300
+
+def estimate_media_tokens(mime_type, duration=None):
+    if mime_type.startswith("image/"): return IMAGE_TOKENS
+    if not duration: return MEDIA_TOKEN_ESTIMATE
+    per_second = VIDEO_TOKENS_PER_SECOND if mime_type.startswith("video/") else AUDIO_TOKENS_PER_SECOND
+    return int(duration * per_second)
 
-def extract_youtube_transcript(youtube_url):
+def is_rate_limit_error(e):
+    return "429" in str(e) or "RESOURCE_EXHAUSTED" in str(e)
+
+async def wait_for_gemini_limiter(estimated_tokens, model=None):
+    started = time.perf_counter()
+    # The model's pause first: waiting in it shouldn't hold a share of the budget
+    await limiter_for(model or model_name).acquire()
+    await gemini_limiter.acquire(estimated_tokens)
+    GEMINI_LIMITER_WAIT_SECONDS.observe(time.perf_counter() - started)
+
+def report_rate_limit(e, model=None):
+    model = model or model_name
+    GEMINI_RATE_LIMITED.labels(model).inc()
+    retry_after = parse_retry_after(e)
+    log_event("gemini_rate_limited", model=model, retry_after=retry_after)
+    if retry_after: limiter_for(model).pause(retry_after)
+
+def report_fallback(model, fallback):
+    GEMINI_FALLBACKS.labels(model).inc()
+    log_event("gemini_fallback", model=model, fallback=fallback)
+
+def report_usage(estimated_tokens, usage, model=None):
+    if not usage: return
+    model = model or model_name
+    gemini_limiter.record_usage(estimated_tokens, usage.total_token_count or 0)
+    record_usage(model, usage)
+
+async def backoff(attempt, kind):
+    delay = backoff_delay(attempt)
+    GEMINI_RETRIES.labels(kind).inc()
+    GEMINI_BACKOFF_SECONDS.inc(delay)
+    await asyncio.sleep(delay)
+
+async def generate_content(contents, config, estimated_tokens, kind="text", model=None):
+    """Single entry point to the Gemini API: waits for the rate limiter and reports quota hints back to it"""
+    if model is None: model = model_name
+    await wait_for_gemini_limiter(estimated_tokens, model)
+    started = time.perf_counter()
+    GEMINI_IN_FLIGHT.inc()
     try:
-        video_id_match = re.search(r"(?<=v=)[^&]+|(?<=youtu.be/)[^?|\n]+", youtube_url)
-        video_id = video_id_match.group(0) if video_id_match else None
-        if video_id is None: return "no transcript"
-        
-        api = YouTubeTranscriptApi()
-        
+        response = await get_gemini_client().aio.models.generate_content(
+            model=model, contents=contents, config=config
+        )
+    except Exception as e:
+        if is_rate_limit_error(e): report_rate_limit(e, model)
+        raise
+    finally:
+        GEMINI_IN_FLIGHT.dec()
+        GEMINI_CALL_SECONDS.labels(model, kind).observe(time.perf_counter() - started)
+    report_usage(estimated_tokens, getattr(response, "usage_metadata", None), model)
+    return response
+
+STREAM_INTERRUPTED = "Ошибка: ответ оборвался, попробуйте ещё раз."
+
+async def generate_content_stream(contents, config, estimated_tokens, on_text, model=None):
+    """Streaming counterpart of generate_content(), returns the full text. A stream cut off
+    after some text arrived returns that text behind STREAM_INTERRUPTED (an error result)."""
+    if model is None: model = model_name
+    await wait_for_gemini_limiter(estimated_tokens, model)
+    started = time.perf_counter()
+    GEMINI_IN_FLIGHT.inc()
+    parts = []
+    usage = None
+    try:
+        async for chunk in await get_gemini_client().aio.models.generate_content_stream(
+            model=model, contents=contents, config=config
+        ):
+            if chunk.text:
+                parts.append(chunk.text)
+                on_text(''.join(parts))
+            usage = getattr(chunk, "usage_metadata", None) or usage
+    except Exception as e:
+        # A 429 can only be retried cleanly before any text reached the user
+        if is_rate_limit_error(e) and not parts:
+            report_rate_limit(e, model)
+            raise
+        if not parts: raise
+        # The user has seen the partial text; marking it as an error keeps it out of
+        # the caches, the journal and the document store
+        print(f"Gemini stream interrupted: {e}")
+        return f"{STREAM_INTERRUPTED}\n\n{''.join(parts)}"
+    finally:
+        GEMINI_IN_FLIGHT.dec()
+        GEMINI_CALL_SECONDS.labels(model, "stream").observe(time.perf_counter() - started)
+    report_usage(estimated_tokens, usage, model)
+    return ''.join(parts)
+
+# --- CONTEXT CACHING ---
+
+# A cached context is shared by every later call about the same document, whatever the
+# answer language, so the language is requested in each prompt instead
+CACHED_LANGUAGE = "the language requested in the prompt"
+context_cache_locks = {}
+# Cache key -> time until which creating that context is not retried
+context_cache_retry_at = {}
+CONTEXT_CACHE_RETRY_SECONDS = 600
+
+def context_cache_key(source, model):
+    return SummaryCache.make_key("context", PROMPT_VERSION, model, source)
+
+async def get_context_cache(source, parts, system_instruction, estimated_tokens, model=None, display_name=None):
+    """Name of a Gemini cached context holding parts plus system_instruction, created on
+    first use. None when the content is below context_cache_min_tokens or caching is
+    unavailable; a failed creation is not retried for the same source and model for a while."""
+    from google.genai import types
+    if not context_caches or not get_gemini_client(): return None
+    if not estimated_tokens or estimated_tokens < context_cache_min_tokens: return None
+    if model is None: model = model_name
+    key = context_cache_key(source, model)
+    now = time.monotonic()
+    if context_cache_retry_at.get(key, 0) > now: return None
+    lock = context_cache_locks.setdefault(key, asyncio.Lock())
+    async with lock:
         try:
-            snippet = api.fetch(video_id, languages=['ru'])
-            if hasattr(snippet, 'to_raw_data'):
-                raw_data = snippet.to_raw_data()
-                transcript_text = ' '.join([item['text'] for item in raw_data])
-                print(f"Debug - Got Russian transcript via to_raw_data, length: {len(transcript_text)}")
-                return transcript_text
-            elif hasattr(snippet, 'snippets'):
-                transcript_text = ' '.join([item['text'] for item in snippet.snippets])
-                print(f"Debug - Got Russian transcript via snippets, length: {len(transcript_text)}")
-                return transcript_text
-        except Exception as e1:
-            print(f"Debug - Russian fetch: {type(e1).__name__}: {str(e1)[:50]}")
-        
+            cached = context_caches.get(key)
+            CACHE_REQUESTS.labels("context", "hit" if cached else "miss").inc()
+            if cached: return cached
+            await wait_for_gemini_limiter(estimated_tokens, model)
+            created = await get_gemini_client().aio.caches.create(model=model, config=types.CreateCachedContentConfig(
+                contents=[types.Content(role="user", parts=parts)], system_instruction=system_instruction,
+                ttl=f"{context_cache_ttl}s", display_name=display_name))
+            context_caches.set(key, created.name)
+            log_event("context_cache_created", name=created.name, kind=display_name, tokens=estimated_tokens)
+            return created.name
+        except Exception as e:
+            if is_rate_limit_error(e): report_rate_limit(e, model)
+            else:
+                # Usually a model without caching support, or content under the model's minimum
+                print(f"Context cache error: {e}")
+                for stale in [k for k, until in context_cache_retry_at.items() if until <= now]:
+                    del context_cache_retry_at[stale]
+                context_cache_retry_at[key] = now + CONTEXT_CACHE_RETRY_SECONDS
+            return None
+        finally:
+            context_cache_locks.pop(key, None)
+
+def forget_context_cache(source, model=None):
+    if context_caches: context_caches.delete(context_cache_key(source, model or model_name))
+
+# --- YOUTUBE & FILES ---
+
+def gemini_file_key(file_obj):
+    return SummaryCache.make_key("gemini-file", file_obj.file_unique_id)
+
+def forget_gemini_file(file_obj):
+    if gemini_files: gemini_files.delete(gemini_file_key(file_obj))
+
+def cached_media_record(file_obj, mime_type):
+    """Document store record for media answered from the summary cache: the upload from
+    the first time, if it is still around, so questions can go to the file as usual"""
+    if not gemini_files: return None
+    stored = gemini_files.get(gemini_file_key(file_obj))
+    if not stored: return None
+    handle = json.loads(stored)
+    tokens = estimate_media_tokens(mime_type, getattr(file_obj, "duration", None))
+    return {"media": {"uri": handle["uri"], "mime_type": handle["mime_type"], "tokens": tokens}}
+
+async def load_media_part(bot, file_obj, mime_type):
+    """Small files are sent inline. Bigger ones are streamed to disk, uploaded through the
+    Files API and the handle is reused for the same Telegram file until it expires."""
+    from google.genai import types
+    file_size = file_obj.file_size or 0
+    if file_size <= inline_media_max_mb * 1024 * 1024:
+        new_file = await bot.get_file(file_obj.file_id)
+        file_bytes = await new_file.download_as_bytearray()
+        return types.Part.from_bytes(data=bytes(file_bytes), mime_type=mime_type)
+
+    cache_key = gemini_file_key(file_obj)
+    if gemini_files:
+        cached = gemini_files.get(cache_key)
+        CACHE_REQUESTS.labels("gemini_files", "hit" if cached else "miss").inc()
+        if cached:
+            handle = json.loads(cached)
+            print(f"Reusing uploaded file {handle['name']}")
+            return types.Part.from_uri(file_uri=handle['uri'], mime_type=handle['mime_type'])
+
+    file_path = f"/tmp/{file_obj.file_unique_id}"
+    try:
+        new_file = await bot.get_file(file_obj.file_id)
+        await new_file.download_to_drive(file_path)
+        uploaded = await get_gemini_client().aio.files.upload(file=file_path, config=types.UploadFileConfig(mime_type=mime_type))
+    finally:
+        if os.path.exists(file_path): os.remove(file_path)
+
+    # Video and audio need server-side processing before they can be referenced
+    for _ in range(60):
+        if uploaded.state != types.FileState.PROCESSING: break
+        await asyncio.sleep(2)
+        uploaded = await get_gemini_client().aio.files.get(name=uploaded.name)
+    if uploaded.state != types.FileState.ACTIVE:
+        raise RuntimeError(f"Gemini file processing failed: {uploaded.state}")
+
+    if gemini_files:
+        gemini_files.set(cache_key, json.dumps({'name': uploaded.name, 'uri': uploaded.uri, 'mime_type': mime_type}))
+    return types.Part.from_uri(file_uri=uploaded.uri, mime_type=mime_type)
+
+async def retrieve_yt_transcript_from_url(youtube_url):
+    video_id = extract_video_id(youtube_url)
+    if video_id is None: raise ValueError("No transcript found.")
+    try:
+        # youtube_transcript_api is blocking, keep it off the event loop
+        _, segments = await asyncio.to_thread(fetch_segments, video_id, yt_languages, transcript_cache)
+    except Exception as e:
+        print(f"Error transcript: {type(e).__name__}: {str(e)[:100]}")
+        segments = []
+    if not segments: raise ValueError("No transcript found.")
+    return segments_to_paragraphs(segments)
+
+# --- DOCUMENT STORE ---
+
+def document_key(chat_id, message_id):
+    return SummaryCache.make_key("doc", chat_id, message_id)
+
+def remember_document(message, source, summary, record=None):
+    """Keep what went into a reply so the buttons under it can reuse the work.
+    record holds the chunk summaries collected by summarize(), the Telegram file_id of a
+    PDF, or the Files API handle of uploaded media from analyze_media()."""
+    message_id = getattr(message, "message_id", None)
+    if not documents or message_id is None or is_error_result(summary): return
+    document = {"source": source, "summary": summary, "chunk_summaries": [], "keywords": None}
+    if record: document.update(record)
+    save_document(message.chat_id, message_id, document)
+
+def save_document(chat_id, message_id, document):
+    try:
+        documents.set(document_key(chat_id, message_id), json.dumps(document, ensure_ascii=False))
+    except Exception as e:
+        print(f"Document store error: {e}")
+
+def find_document(chat_id, message_id):
+    """Document behind a reply, following answers back to the reply they belong to.
+    Returns (message_id of that reply, document) or (None, None)."""
+    document = load_document(chat_id, message_id)
+    if document and "parent" in document:
+        message_id = document["parent"]
+        document = load_document(chat_id, message_id)
+    if not document: return None, None
+    return message_id, document
+
+def load_document(chat_id, message_id):
+    if not documents: return None
+    try:
+        stored = documents.get(document_key(chat_id, message_id))
+        CACHE_REQUESTS.labels("documents", "hit" if stored else "miss").inc()
+        return json.loads(stored) if stored else None
+    except Exception as e:
+        print(f"Document store error: {e}")
+        return None
+
+# --- QUESTIONS ---
+
+# BM25 indexes of recently asked-about documents, keyed by source
+qa_indexes = OrderedDict()
+QA_INDEX_LIMIT = 32
+
+async def source_text(bot, document):
+    """Re-extract the text of a stored document from its source"""
+    kind, _, ref = document["source"].partition(":")
+    if kind == "url": return await process_user_input(ref)
+    if kind == "youtube": return await process_user_input(f"https://youtu.be/{ref}")
+    if kind == "text": return split_user_input(ref)
+    if kind == "pdf" and document.get("file_id"):
+        file_path = f"/tmp/{ref}.pdf"
         try:
-            snippet = api.fetch(video_id, languages=['en'])
-            if hasattr(snippet, 'to_raw_data'):
-                raw_data = snippet.to_raw_data()
-                transcript_text = ' '.join([item['text'] for item in raw_data])
-                print(f"Debug - Got English transcript via to_raw_data, length: {len(transcript_text)}")
-                return transcript_text
-            elif hasattr(snippet, 'snippets'):
-                transcript_text = ' '.join([item['text'] for item in snippet.snippets])
-                print(f"Debug - Got English transcript via snippets, length: {len(transcript_text)}")
-                return transcript_text
-        except Exception as e2:
-            print(f"Debug - English fetch: {type(e2).__name__}")
-        
+            file = await bot.get_file(document["file_id"])
+            await file.download_to_drive(file_path)
+            return [page async for page in iter_pdf_pages(file_path, get_process_pool(), max_pending=pdf_workers)]
+        finally:
+            if os.path.exists(file_path): os.remove(file_path)
+    return []
+
+def build_qa_index(texts):
+    passages = []
+    for text in texts:
+        passages += [p for p in iter_chunks(text.split('\n'), qa_passage_tokens) if p.strip()]
+    return BM25Index(passages)
+
+async def get_qa_index(bot, document):
+    source = document["source"]
+    index = qa_indexes.get(source)
+    if index:
+        qa_indexes.move_to_end(source)
+        return index
+    # Media and batch replies have no text of their own, their partial summaries stand in
+    texts = await source_text(bot, document) or document.get("chunk_summaries") or [document["summary"]]
+    index = await asyncio.to_thread(build_qa_index, texts)
+    qa_indexes[source] = index
+    while len(qa_indexes) > QA_INDEX_LIMIT: qa_indexes.popitem(last=False)
+    return index
+
+def qa_system_instruction(target_lang):
+    return (
+        f"You answer questions about a document. Respond in {target_lang}. "
+        "Use only the summary and the excerpts you are given. "
+        "If they do not contain the answer, say so briefly instead of guessing. "
+        "Write in PLAIN TEXT ONLY. No Markdown, no bold (**), no italics (*), no headers (#), no links []. "
+    )
+
+def media_qa_system_instruction(target_lang):
+    return (
+        f"You answer questions about the attached file. Respond in {target_lang}. "
+        "If the file does not contain the answer, say so briefly instead of guessing. "
+        "Write in PLAIN TEXT ONLY. No Markdown, no bold (**), no italics (*), no headers (#), no links []. "
+    )
+
+async def answer_from_media(document, question):
+    """Questions about uploaded audio or video go to the file itself. It is put in a cached
+    context on the first question, so later ones only pay the cached-token rate."""
+    from google.genai import types
+    media = document["media"]
+    part = types.Part.from_uri(file_uri=media["uri"], mime_type=media["mime_type"])
+    return await analyze_media(part, f"Question: {question}", media_tokens=media["tokens"],
+                               instruction=media_qa_system_instruction, site="qa", cache_source=document["source"])
+
+async def answer_question(update, context, chat_id, message_id, document, question):
+    """Answer a question sent as a reply to a summary: only the passages that match the
+    question best are sent to Gemini, together with the summary for overall context.
+    Uploaded media has no text to search, those questions go to the file itself."""
+    cache_key = summary_cache_key(f"qa:{document['source']}:{' '.join(question.lower().split())}")
+    cached = get_cached_summary(cache_key)
+    if cached:
+        answer_message = await update.message.reply_text(cached)
+        save_document(chat_id, answer_message.message_id, {"parent": message_id})
+        return
+
+    async def run():
         try:
-            snippet = api.fetch(video_id)
-            if hasattr(snippet, 'to_raw_data'):
-                raw_data = snippet.to_raw_data()
-                transcript_text = ' '.join([item['text'] for item in raw_data])
-                print(f"Debug - Got default transcript via to_raw_data, length: {len(transcript_text)}")
-                return transcript_text
-            elif hasattr(snippet, 'snippets'):
-                transcript_text = ' '.join([item['text'] for item in snippet.snippets])
-                print(f"Debug - Got default transcript via snippets, length: {len(transcript_text)}")
-                return transcript_text
-        except Exception as e3:
-            print(f"Debug - Default fetch: {type(e3).__name__}")
-        
-        print("Debug - Could not find any transcript")
-        return "no transcript"
-            
-    except Exception as e:
-        print(f"Error transcript: {e}")
-        return "no transcript"
+            await context.bot.send_chat_action(chat_id=chat_id, action="TYPING")
+            answer = None
+            if document.get("media"):
+                with stage("qa", "answer_media"):
+                    answer = await answer_from_media(document, question)
+                if is_error_result(answer):
+                    # Usually the upload expired; the summary is all that is left to go on
+                    print(f"Media QA failed, answering from the summary: {answer}")
+                    document.pop("media")
+                    save_document(chat_id, message_id, document)
+                    answer = None
+            if answer is None:
+                with stage("qa", "retrieve"):
+                    index = await get_qa_index(context.bot, document)
+                    passages = index.top(question, qa_top_k)
+                excerpts = '\n\n'.join(f"[{n}] {p}" for n, p in enumerate(passages, 1)) or "(no matching excerpts)"
+                prompt = (f"Summary of the document:\n{document['summary']}\n\n"
+                          f"Excerpts:\n{excerpts}\n\nQuestion: {question}")
+                log_event("qa", passages=len(passages), prompt_tokens=estimate_tokens(prompt))
+                with stage("qa", "answer"):
+                    answer = await call_gemini_with_retry(prompt, qa_system_instruction(lang), model=router.route("qa", estimate_tokens(prompt)))
+            store_cached_summary(cache_key, answer)
+            answer_message = await update.message.reply_text(answer or "Модель вернула пустой ответ.")
+            # Replying to the answer asks about the same document again
+            save_document(chat_id, answer_message.message_id, {"parent": message_id})
+        except Exception as e:
+            print(f"QA Error: {e}")
+            await update.message.reply_text(f"Ошибка: {e}")
+
+    # Without an index in memory the source is fetched and parsed again
+    await enqueue_job(update, chat_id, LIGHT if document["source"] in qa_indexes else HEAVY, run)
+
+# --- BATCH ---
+
+def batch_source_key(item):
+    """Cache identity of a batch item: the same normalization as single requests for URLs,
+    path plus size and mtime for local files (CLI only)"""
+    if os.path.isfile(item):
+        st = os.stat(item)
+        return f"file:{os.path.abspath(item)}:{st.st_size}:{int(st.st_mtime)}"
+    return normalize_user_input(item)
+
+async def load_batch_item(item):
+    if os.path.isfile(item):
+        if item.lower().endswith(".pdf"):
+            return [page async for page in iter_pdf_pages(item, get_process_pool(), max_pending=pdf_workers)]
+        with open(item, encoding="utf-8", errors="replace") as f:
+            return split_user_input(f.read())
+    return await process_user_input(item)
 
-def retrieve_yt_transcript_from_url(youtube_url):
-    output = extract_youtube_transcript(youtube_url)
-    if output == 'no transcript': raise ValueError("No transcript found.")
-    return [output]
+async def summarize_batch(items, target_lang=None, on_progress=None):
+    """Summarize many URLs/files in one go. Returns (digest, [(item, summary), ...]).
+
+    Cached items cost nothing, the rest are fetched concurrently. Short documents are packed
+    several per Gemini request, long ones get the regular map-reduce. on_progress receives
+    a status line as items complete."""
+    if target_lang is None: target_lang = lang
+    sources = {}
+    for item in items:
+        sources.setdefault(batch_source_key(item), item)
+    keys = list(sources)
+    summaries = {}
+    for key in keys:
+        cached = get_cached_summary(summary_cache_key(key, target_lang))
+        if cached: summaries[key] = cached
+    log_event("batch", items=len(keys), cached=len(summaries))
+
+    semaphore = asyncio.Semaphore(batch_concurrency)
+
+    def report():
+        if on_progress: on_progress(f"⏳ Пакет: готово {len(summaries)} из {len(keys)}")
+
+    def finish(key, summary):
+        summaries[key] = summary
+        store_cached_summary(summary_cache_key(key, target_lang), summary)
+        report()
+
+    async def fetch(key):
+        async with semaphore:
+            try:
+                return key, await load_batch_item(sources[key])
+            except Exception as e:
+                print(f"Batch fetch error {sources[key]}: {e}")
+                return key, []
+
+    async def summarize_one(key, paragraphs):
+        async with semaphore:
+            finish(key, await summarize(paragraphs, target_lang=target_lang))
+
+    async def summarize_group(group):
+        async with semaphore:
+            prompt = build_packed_prompt(group)
+            answer = await call_gemini_with_retry(prompt, text_system_instruction(target_lang), model=router.route("map", estimate_tokens(prompt)))
+        parsed = parse_packed_summaries(answer, len(group))
+        for n, (key, text) in enumerate(group, 1):
+            if n in parsed: finish(key, strip_content_type_label(parsed[n]))
+        # Items the model merged or dropped are redone one by one
+        await asyncio.gather(*(summarize_one(key, [text]) for n, (key, text) in enumerate(group, 1) if n not in parsed))
+
+    with stage("batch", "fetch"):
+        fetched = await asyncio.gather(*(fetch(key) for key in keys if key not in summaries))
+    texts = []
+    for key, paragraphs in fetched:
+        if paragraphs: texts.append((key, '\n'.join(paragraphs)))
+        else: summaries[key] = "Ошибка: не удалось получить текст."
+    report()
+
+    groups, large = pack_items(texts, chunk_tokens)
+    with stage("batch", "summarize"):
+        await asyncio.gather(*(summarize_group(group) for group in groups),
+                             *(summarize_one(key, text.split('\n')) for key, text in large))
+
+    results = [(sources[key], summaries.get(key, "Ошибка: пустой ответ.")) for key in keys]
+    good = [(n, summary) for n, (_, summary) in enumerate(results, 1) if not is_error_result(summary)]
+    if len(good) < 2:
+        return (good[0][1] if good else "Ошибка: ни один источник не удалось обработать."), results
+
+    # Each item gets an equal share of one request for the digest
+    share = max(500, chunk_size // len(good))
+    prompt = (f"Write a short digest in {target_lang} of the following {len(good)} summaries: "
+              "the common themes first, then one line per item with its number.\n\n"
+              + '\n\n'.join(f"[{n}] {summary[:share]}" for n, summary in good))
+    with stage("batch", "digest"):
+        model = router.route("reduce", estimate_tokens(prompt))
+        digest = strip_content_type_label(await call_gemini_with_retry(prompt, text_system_instruction(target_lang), model=model))
+    return digest, results
 
 # --- HANDLERS ---
 
 async def handle_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     msg = (f"Привет! Я использую модель {model_name}.\n\n"
            "Я умею анализировать:\nТекст и ссылки\nYouTube\nPDF\nФото\nАудио\nВидео\n\n"
-           "Кидай что угодно!")
+           "Кидай что угодно!\n/batch ссылка1 ссылка2 ... — дайджест по списку ссылок\n"
+           "Ответь на саммари вопросом — отвечу по тексту документа.")
     await update.message.reply_text(msg)
 
 async def handle_summarize(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
+    new_request_id()
+    log_event("update", handler="text", chat_id=chat_id)
     if allowed_users and str(chat_id) not in allowed_users.split(','):
         await update.message.reply_text("Access denied.")
         return
+    # A reply to one of our summaries is a question about that document
+    reply_to = getattr(update.message, "reply_to_message", None)
+    if reply_to:
+        message_id, document = find_document(chat_id, reply_to.message_id)
+        if document:
+            await answer_question(update, context, chat_id, message_id, document, update.message.text)
+            return
     await process_request(update.message.text, chat_id, update, context)
 
 async def handle_media_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
+    new_request_id()
+    log_event("update", handler="media", chat_id=chat_id)
     if allowed_users and str(chat_id) not in allowed_users.split(','):
         await update.message.reply_text("Access denied.")
         return
@@ -349,109 +1143,307 @@ async def handle_media_message(update: Update, context: ContextTypes.DEFAULT_TYP
         await update.message.reply_text("Анализирую видео-сообщение...")
 
     if not file_obj: return
-    if file_obj.file_size > 20 * 1024 * 1024:
-        await update.message.reply_text("⚠️ Файл >20MB.")
+    if (file_obj.file_size or 0) > max_file_size_mb * 1024 * 1024:
+        await update.message.reply_text(f"⚠️ Файл >{max_file_size_mb}MB.")
         return
 
-    await context.bot.send_chat_action(chat_id=chat_id, action=action)
-    try:
-        new_file = await context.bot.get_file(file_obj.file_id)
-        file_bytes = await new_file.download_as_bytearray()
-        loop = asyncio.get_running_loop()
-        summary = await loop.run_in_executor(None, analyze_media, file_bytes, mime_type, prompt)
-        await update.message.reply_text(f"{summary}", reply_markup=get_inline_keyboard_buttons())
-    except Exception as e:
-        print(f"Media Error: {e}")
-        await update.message.reply_text(f"Ошибка: {e}")
+    source = f"media:{file_obj.file_unique_id}"
+    cache_key = summary_cache_key(f"{source}:{prompt}")
+    cached = get_cached_summary(cache_key)
+    if cached:
+        message = await update.message.reply_text(f"{cached}", reply_markup=get_inline_keyboard_buttons())
+        remember_document(message, source, cached, cached_media_record(file_obj, mime_type))
+        return
+
+    await start_media_job(update, context, chat_id, {
+        "handler": "media", "file_id": file_obj.file_id, "file_unique_id": file_obj.file_unique_id,
+        "file_size": file_obj.file_size, "mime_type": mime_type, "prompt": prompt, "action": action,
+        "duration": getattr(file_obj, "duration", None), "lane": LIGHT if message.photo else HEAVY,
+    })
+
+async def start_media_job(update, context, chat_id, payload, job_id=None):
+    """Queue the analysis of a photo, audio or video. payload only holds plain values
+    so the job can be resumed from the journal after a restart."""
+    handler = payload["handler"]
+    file_obj = SimpleNamespace(file_id=payload["file_id"], file_unique_id=payload["file_unique_id"],
+                               file_size=payload["file_size"])
+    source = f"media:{payload['file_unique_id']}"
+    cache_key = summary_cache_key(f"{source}:{payload['prompt']}")
+
+    async def run():
+        await context.bot.send_chat_action(chat_id=chat_id, action=payload["action"])
+        try:
+            with stage(handler, "load_media"):
+                media_part = await load_media_part(context.bot, file_obj, payload["mime_type"])
+            with stage(handler, "analyze"):
+                record = {}
+                media_tokens = estimate_media_tokens(payload["mime_type"], payload.get("duration"))
+                summary = await analyze_media(media_part, payload["prompt"], media_tokens=media_tokens, record=record)
+                if media_part.file_data and summary.startswith(MEDIA_ERROR):
+                    # The stored upload may be gone (deleted, or made with another API key)
+                    print("Uploading the file again after a media error")
+                    forget_gemini_file(file_obj)
+                    with stage(handler, "load_media"):
+                        media_part = await load_media_part(context.bot, file_obj, payload["mime_type"])
+                    summary = await analyze_media(media_part, payload["prompt"], media_tokens=media_tokens, record=record)
+            store_cached_summary(cache_key, summary)
+            with stage(handler, "reply"):
+                message = await update.message.reply_text(f"{summary}", reply_markup=get_inline_keyboard_buttons())
+            remember_document(message, source, summary, record)
+        except Exception as e:
+            print(f"Media Error: {e}")
+            await update.message.reply_text(f"Ошибка видео: {e}" if handler == "video_document" else f"Ошибка: {e}")
+
+    await enqueue_job(update, chat_id, payload["lane"], run, ("media", payload), job_id)
 
 async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
     doc = update.message.document
+    new_request_id()
+    log_event("update", handler="document", chat_id=chat_id, mime_type=doc.mime_type, file_size=doc.file_size)
     if doc.mime_type == 'application/pdf':
-        await context.bot.send_chat_action(chat_id=chat_id, action="TYPING")
+        source = f"pdf:{doc.file_unique_id}"
+        cache_key = summary_cache_key(source)
+        cached = get_cached_summary(cache_key)
+        if cached:
+            message = await update.message.reply_text(f"**PDF Summary:**\n\n{cached}", reply_markup=get_inline_keyboard_buttons())
+            remember_document(message, source, cached, {"file_id": doc.file_id})
+            return
         await update.message.reply_text("Читаю PDF...")
-        file_path = f"/tmp/{doc.file_unique_id}.pdf"
+        await start_pdf_job(update, context, chat_id, {"file_id": doc.file_id, "file_unique_id": doc.file_unique_id})
+    elif "image" in doc.mime_type or "audio" in doc.mime_type:
+        await update.message.reply_text("Отправьте как Фото/Аудио, а не как Файл.")
+    elif "video" in doc.mime_type:
+        file_size = doc.file_size or 0
+        if file_size > max_file_size_mb * 1024 * 1024:
+            await update.message.reply_text(f"⚠️ Файл >{max_file_size_mb}MB.")
+            return
+        mime_type = doc.mime_type or "video/mp4"
+        prompt = (f"Watch this video. Analyze its content (educational lecture, news or other). "
+                  f"For educational: list all rules, definitions, formulas, and examples. "
+                  f"For news: concise factual summary. For other: describe what is shown. "
+                  f"ONLY output the final text. Do NOT output the content type or introductory phrases. Respond in {lang}.")
+        source = f"media:{doc.file_unique_id}"
+        cached = get_cached_summary(summary_cache_key(f"{source}:{prompt}"))
+        if cached:
+            message = await update.message.reply_text(f"{cached}", reply_markup=get_inline_keyboard_buttons())
+            remember_document(message, source, cached, cached_media_record(doc, mime_type))
+            return
+        await start_media_job(update, context, chat_id, {
+            "handler": "video_document", "file_id": doc.file_id, "file_unique_id": doc.file_unique_id,
+            "file_size": doc.file_size, "mime_type": mime_type, "prompt": prompt, "action": "UPLOAD_VIDEO",
+            "lane": HEAVY,
+        })
+    else:
+        await update.message.reply_text(f"Не поддерживаю {doc.mime_type}.")
+
+async def start_pdf_job(update, context, chat_id, payload, job_id=None):
+    source = f"pdf:{payload['file_unique_id']}"
+    cache_key = summary_cache_key(source)
+
+    async def run():
+        await context.bot.send_chat_action(chat_id=chat_id, action="TYPING")
+        file_path = f"/tmp/{payload['file_unique_id']}.pdf"
         try:
-            file = await context.bot.get_file(doc)
-            await file.download_to_drive(file_path)
-            text_array = []
-            reader = PdfReader(file_path)
-            for page in reader.pages:
-                t = page.extract_text()
-                if t: text_array.append(t)
-            loop = asyncio.get_running_loop()
-            summary = await loop.run_in_executor(None, summarize, text_array)
-            await update.message.reply_text(f"**PDF Summary:**\n\n{summary}", reply_markup=get_inline_keyboard_buttons())
+            with stage("pdf", "download"):
+                file = await context.bot.get_file(payload["file_id"])
+                await file.download_to_drive(file_path)
+            # Pages are parsed in worker processes and streamed straight into summarize()
+            pages = iter_pdf_pages(file_path, get_process_pool(), max_pending=pdf_workers)
+            reply = await start_progressive_reply(context, chat_id)
+            # The file_id lets questions about the PDF download it again
+            record = {"file_id": payload["file_id"]}
+            with stage("pdf", "extract_and_summarize"):
+                summary = await summarize(pages, on_progress=reply.update if reply else None, record=record)
+            store_cached_summary(cache_key, summary)
+            with stage("pdf", "reply"):
+                if reply: message = await reply.finish(f"**PDF Summary:**\n\n{summary}", reply_markup=get_inline_keyboard_buttons())
+                else: message = await update.message.reply_text(f"**PDF Summary:**\n\n{summary}", reply_markup=get_inline_keyboard_buttons())
+            remember_document(message, source, summary, record)
         except Exception as e:
             print(f"PDF Error: {e}")
             await update.message.reply_text(f"Ошибка PDF: {e}")
         finally:
             if os.path.exists(file_path): os.remove(file_path)
-    elif "image" in doc.mime_type or "audio" in doc.mime_type:
-        await update.message.reply_text("Отправьте как Фото/Аудио, а не как Файл.")
-    elif "video" in doc.mime_type:
-        await context.bot.send_chat_action(chat_id=chat_id, action="UPLOAD_VIDEO")
-        try:
-            file_size = doc.file_size or 0
-            if file_size > 20 * 1024 * 1024:
-                await update.message.reply_text("⚠️ Файл >20MB.")
-                return
-            new_file = await context.bot.get_file(doc)
-            file_bytes = await new_file.download_as_bytearray()
-            mime_type = doc.mime_type or "video/mp4"
-            prompt = (f"Watch this video. Analyze its content (educational lecture, news or other). "
-                      f"For educational: list all rules, definitions, formulas, and examples. "
-                      f"For news: concise factual summary. For other: describe what is shown. "
-                      f"ONLY output the final text. Do NOT output the content type or introductory phrases. Respond in {lang}.")
-            loop = asyncio.get_running_loop()
-            summary = await loop.run_in_executor(None, analyze_media, file_bytes, mime_type, prompt)
-            await update.message.reply_text(f"{summary}", reply_markup=get_inline_keyboard_buttons())
-        except Exception as e:
-            print(f"Video Doc Error: {e}")
-            await update.message.reply_text(f"Ошибка видео: {e}")
-    else:
-        await update.message.reply_text(f"Не поддерживаю {doc.mime_type}.")
+
+    await enqueue_job(update, chat_id, HEAVY, run, ("pdf", payload), job_id)
 
 async def process_request(user_input, chat_id, update, context):
     if len(user_input.strip()) < 30 and not re.match(r"https?://", user_input.strip()):
         await context.bot.send_message(chat_id=chat_id, text="Текст слишком короткий (минимум 30 символов).")
         return
 
+    source = normalize_user_input(user_input)
+    cache_key = summary_cache_key(source)
+    cached = get_cached_summary(cache_key)
+    if cached:
+        message = await context.bot.send_message(chat_id=chat_id, text=f"{cached}", reply_markup=get_inline_keyboard_buttons())
+        remember_document(message, source, cached)
+        return
+    await start_text_job(update, context, chat_id, {"user_input": user_input})
+
+async def start_text_job(update, context, chat_id, payload, job_id=None):
+    user_input = payload["user_input"]
+    source = normalize_user_input(user_input)
+    cache_key = summary_cache_key(source)
+
+    async def run():
+        try:
+            with stage("text", "extract"):
+                text_array = await process_user_input(user_input)
+            if not text_array:
+                msg = "Пустой ввод."
+                await context.bot.send_message(chat_id=chat_id, text=msg)
+                return
+            await context.bot.send_chat_action(chat_id=chat_id, action="TYPING")
+            reply = await start_progressive_reply(context, chat_id)
+            record = {}
+            with stage("text", "summarize"):
+                summary = await summarize(text_array, on_progress=reply.update if reply else None, record=record)
+            store_cached_summary(cache_key, summary)
+            with stage("text", "reply"):
+                if reply: message = await reply.finish(f"{summary}", reply_markup=get_inline_keyboard_buttons())
+                else: message = await context.bot.send_message(chat_id=chat_id, text=f"{summary}", reply_markup=get_inline_keyboard_buttons())
+            remember_document(message, source, summary, record)
+        except Exception as e:
+            print(f"Processing Error: {e}")
+            await context.bot.send_message(chat_id=chat_id, text=f"Ошибка: {e}")
+
+    await enqueue_job(update, chat_id, request_lane(user_input), run, ("text", payload), job_id)
+
+async def start_progressive_reply(context, chat_id):
+    """Placeholder message that summarize() keeps editing with partial results"""
+    if not progressive_replies: return None
+    reply = ProgressiveReply(context.bot, chat_id, interval=progress_edit_interval)
+    await reply.start()
+    progressive_reply_var.set(reply)
+    return reply
+
+def request_lane(user_input):
+    """Short text and web articles are cheap, YouTube transcripts and long texts go to the heavy lane"""
+    text = user_input.strip()
+    if extract_video_id(text): return HEAVY
+    if re.match(r"https?://", text) or len(text) < chunk_size: return LIGHT
+    return HEAVY
+
+async def enqueue_job(update, chat_id, lane, run, journal_entry=None, job_id=None):
+    """journal_entry, a (kind, payload) pair, makes the job survive restarts: it is
+    resumed by resume_jobs() unless it finished or the user cancelled it"""
+    request_id = request_id_var.get()
+    queued_at = time.perf_counter()
+    if job_id is None: job_id = request_id
+    if not (journal and journal_entry): job_id = None
+
+    async def job():
+        # Jobs run in the queue's worker tasks, carry the request ID over explicitly
+        set_request_id(request_id)
+        journal_job_var.set(job_id)
+        STAGE_SECONDS.labels("queue", lane).observe(time.perf_counter() - queued_at)
+        if job_id: journal.set_stage(job_id, "running")
+        done = False
+        try:
+            with stage("job", lane):
+                await run()
+            done = True
+        except asyncio.CancelledError:
+            # /cancel, not the shutdown: don't leave "⏳ Обрабатываю..." hanging in the chat
+            reply = progressive_reply_var.get()
+            if reply and not draining: await reply.abort("Задача отменена.")
+            raise
+        finally:
+            # A job cut off by the shutdown stays in the journal and is resumed on the next start
+            if job_id and (done or not draining): journal.finish(job_id)
+
+    if job_id: journal.add(job_id, chat_id, *journal_entry)
     try:
-        text_array = process_user_input(user_input)
-        if not text_array:
-            msg = "Пустой ввод."
-            await context.bot.send_message(chat_id=chat_id, text=msg)
-            return
-        await context.bot.send_chat_action(chat_id=chat_id, action="TYPING")
-        loop = asyncio.get_running_loop()
-        summary = await loop.run_in_executor(None, summarize, text_array)
-        await context.bot.send_message(chat_id=chat_id, text=f"{summary}", reply_markup=get_inline_keyboard_buttons())
-    except Exception as e:
-        print(f"Processing Error: {e}")
-        await context.bot.send_message(chat_id=chat_id, text=f"Ошибка: {e}")
+        position = await job_queue.submit(chat_id, lane, job)
+    except QueueFull:
+        if job_id: journal.finish(job_id)
+        log_event("queue_full", lane=lane, chat_id=chat_id)
+        await update.effective_message.reply_text("Очередь переполнена, попробуйте позже.")
+        return
+    log_event("queued", lane=lane, position=position)
+    if position: await update.effective_message.reply_text(f"В очереди, позиция {position}.")
+
+async def handle_batch(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat_id = update.effective_chat.id
+    new_request_id()
+    log_event("update", handler="batch", chat_id=chat_id)
+    if allowed_users and str(chat_id) not in allowed_users.split(','):
+        await update.message.reply_text("Access denied.")
+        return
+    items = parse_batch_items(update.message.text or "")
+    if not items:
+        await update.message.reply_text("Пришлите ссылки после команды: /batch ссылка1 ссылка2 ...")
+        return
+    if len(items) > batch_max_items:
+        await update.message.reply_text(f"⚠️ Не больше {batch_max_items} ссылок за раз.")
+        return
+
+    await start_batch_job(update, context, chat_id, {"items": items})
+
+async def start_batch_job(update, context, chat_id, payload, job_id=None):
+    items = payload["items"]
+
+    async def run():
+        try:
+            reply = await start_progressive_reply(context, chat_id)
+            with stage("batch", "total"):
+                digest, results = await summarize_batch(items, on_progress=reply.update if reply else None)
+            details = '\n\n'.join(format_item(n, source, summary) for n, (source, summary) in enumerate(results, 1))
+            with stage("batch", "reply"):
+                if reply: message = await reply.finish(f"📰 Дайджест:\n\n{digest}", reply_markup=get_inline_keyboard_buttons())
+                else: message = await context.bot.send_message(chat_id=chat_id, text=f"📰 Дайджест:\n\n{digest}", reply_markup=get_inline_keyboard_buttons())
+                for part in split_message(details):
+                    await context.bot.send_message(chat_id=chat_id, text=part, disable_web_page_preview=True)
+            remember_document(message, "batch:" + " ".join(items), digest,
+                              {"chunk_summaries": [summary for _, summary in results if not is_error_result(summary)]})
+        except Exception as e:
+            print(f"Batch Error: {e}")
+            await context.bot.send_message(chat_id=chat_id, text=f"Ошибка: {e}")
+
+    await enqueue_job(update, chat_id, HEAVY, run, ("batch", payload), job_id)
+
+async def handle_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    cancelled = await job_queue.cancel(update.effective_chat.id)
+    if journal: journal.finish_chat(update.effective_chat.id)
+    if cancelled: await update.message.reply_text(f"Отменено задач: {cancelled}.")
+    else: await update.message.reply_text("Нет активных задач.")
+
+async def extract_keywords(text):
+    # Use only the first ~800 chars to avoid sending full summary noise
+    excerpt = text.strip()[:800]
+    prompt = (
+        f"{excerpt}\n\n"
+        "Based on the text above, extract ONLY the core subject name or topic (e.g. a game title, movie name, person, company, etc.). "
+        "Return a SHORT Google search query of 2 to 4 words maximum. "
+        "Focus on the main noun/entity. Do NOT include descriptive adjectives, review words, or gameplay details. "
+        "Return ONLY the query, no quotes, no explanation."
+    )
+    keywords = await call_gemini_with_retry(prompt, None, retries=2, model=router.route("keywords", estimate_tokens(prompt)))
+    if is_error_result(keywords): return ""
+    keywords = keywords.replace('"', '').strip()
+    # Safety: truncate to 5 words max
+    return ' '.join(keywords.split()[:5])
 
 async def handle_button_click(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     if query.data == "explore_similar":
-        clean_text = query.message.text
-        for garbage in ["Результат из Web App:", "Результат:", "PDF Summary:", "Саммари аудио:"]:
-            clean_text = clean_text.replace(garbage, "")
-        
-        # Use only the first ~800 chars to avoid sending full summary noise
-        excerpt = clean_text.strip()[:800]
-        prompt = (
-            f"{excerpt}\n\n"
-            "Based on the text above, extract ONLY the core subject name or topic (e.g. a game title, movie name, person, company, etc.). "
-            "Return a SHORT Google search query of 2 to 4 words maximum. "
-            "Focus on the main noun/entity. Do NOT include descriptive adjectives, review words, or gameplay details. "
-            "Return ONLY the query, no quotes, no explanation."
-        )
-        
-        keywords = call_gemini_api(prompt).replace('"', '').strip()
-        # Safety: truncate to 5 words max
-        keywords = ' '.join(keywords.split()[:5])
+        # Keywords are derived once per reply and kept in the document store
+        document = load_document(query.message.chat_id, query.message.message_id)
+        keywords = document.get("keywords") if document else None
+        if not keywords:
+            if document: clean_text = document["summary"]
+            else:
+                # Replies from before the document store, or expired ones
+                clean_text = query.message.text
+                for garbage in ["Результат из Web App:", "Результат:", "PDF Summary:", "Саммари аудио:"]:
+                    clean_text = clean_text.replace(garbage, "")
+            keywords = await extract_keywords(clean_text)
+            if document and keywords:
+                document["keywords"] = keywords
+                save_document(query.message.chat_id, query.message.message_id, document)
         
         results = await search_results(keywords)
         print(f"🔎 Keywords used: {keywords}")
@@ -471,26 +1463,160 @@ async def handle_button_click(update: Update, context: ContextTypes.DEFAULT_TYPE
                 disable_web_page_preview=True
             )
 
-def process_user_input(user_input):
-    if re.match(r"https?://(www\.|m\.)?(youtube\.com|youtu\.be)/", user_input):
-        return retrieve_yt_transcript_from_url(user_input)
+async def process_user_input(user_input):
+    if extract_video_id(user_input):
+        return await retrieve_yt_transcript_from_url(user_input)
     elif re.match(r"https?://", user_input):
-        return scrape_text_from_url(user_input)
+        return await scrape_text_from_url(user_input)
     return split_user_input(user_input)
 
 def get_inline_keyboard_buttons():
     return InlineKeyboardMarkup([[InlineKeyboardButton("Explore Similar", callback_data="explore_similar")]])
 
-def main():
-    print_available_models()
-    app = ApplicationBuilder().token(telegram_token).build()
+JOB_STARTERS = {"text": start_text_job, "pdf": start_pdf_job, "media": start_media_job, "batch": start_batch_job}
+
+def resumed_update(bot, chat_id):
+    """Stand-in for the original Update of a resumed job: replies go to the chat as new messages"""
+    message = SimpleNamespace(chat_id=chat_id, reply_text=partial(bot.send_message, chat_id))
+    return SimpleNamespace(effective_chat=SimpleNamespace(id=chat_id), message=message, effective_message=message)
+
+async def resume_jobs(bot, accepted_before):
+    """Queue the jobs a previous run accepted (before accepted_before) but did not finish"""
+    # Webhook workers only take the chats the dispatcher sends them
+    worker_index = int(os.environ.get("WORKER_INDEX", 0))
+    chat_filter = None
+    if webhook_url and webhook_workers > 1:
+        chat_filter = lambda chat_id: hash(chat_id) % webhook_workers == worker_index
+    for entry in journal.claim_pending(chat_filter=chat_filter, before=accepted_before):
+        starter = JOB_STARTERS.get(entry["kind"])
+        if not starter:
+            journal.finish(entry["id"])
+            continue
+        set_request_id(entry["id"])
+        log_event("job_resumed", kind=entry["kind"], chat_id=entry["chat_id"], stage=entry["stage"])
+        update = resumed_update(bot, entry["chat_id"])
+        try:
+            await update.message.reply_text("🔄 Бот был перезапущен, продолжаю обработку вашего запроса...")
+            await starter(update, SimpleNamespace(bot=bot), entry["chat_id"], entry["payload"], job_id=entry["id"])
+        except Exception as e:
+            print(f"Resume Error: {e}")
+
+# --- STARTUP ---
+
+# Seconds from process_started to each startup phase
+startup_times = {}
+# Keeps the background startup tasks referenced until they finish
+startup_tasks = set()
+# Imported by prewarm(): slow imports the first request of each kind would otherwise wait for
+PREWARM_MODULES = ("google.genai.types", "tqdm", "youtube_transcript_api")
+
+def mark_startup(phase, at=None):
+    if phase in startup_times: return
+    startup_times[phase] = round((at or time.perf_counter()) - process_started, 3)
+    STARTUP_SECONDS.labels(phase).set(startup_times[phase])
+    log_event("startup", phase=phase, seconds=startup_times[phase])
+
+def start_background(coro):
+    task = asyncio.create_task(coro)
+    startup_tasks.add(task)
+    task.add_done_callback(startup_tasks.discard)
+
+async def prewarm():
+    """Load what the first requests need while the bot is already answering"""
+    started = time.perf_counter()
+    try:
+        # The pool workers are forked (and load the extractors) before the import thread
+        # starts: a process forked while another thread imports can inherit a held import lock
+        warmup = asyncio.get_running_loop().run_in_executor(get_process_pool(), len, "")
+
+        def load_modules():
+            for module in PREWARM_MODULES: importlib.import_module(module)
+            get_gemini_client()
+
+        await asyncio.gather(asyncio.to_thread(load_modules), warmup)
+        log_event("prewarm", seconds=round(time.perf_counter() - started, 3))
+    except Exception as e:
+        print(f"Prewarm Error: {e}")
+
+async def check_models():
+    """Model listing and route validation, off the startup path: until it finishes
+    the configured routes are used as they are"""
+    validate_model_routes(await print_available_models())
+    mark_startup("models_checked")
+
+async def note_first_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if "first_update" not in startup_times: mark_startup("first_update")
+
+async def on_startup(app):
+    mark_startup("imports", imported_at)
+    job_queue.start()
+    # Resumed jobs send a notice each, that shouldn't hold up polling
+    if journal: start_background(resume_jobs(app.bot, time.time()))
+    if metrics_port:
+        # Webhook cluster workers each expose their own registry on the next port
+        port = metrics_port + int(os.environ.get("WORKER_INDEX", 0))
+        try:
+            start_metrics_server(port, metrics_addr)
+        except OSError as e:
+            print(f"❌ Metrics server not started: {e}")
+    start_background(check_models())
+    if prewarm_enabled: start_background(prewarm())
+    mark_startup("ready")
+    print("⏱ Startup: " + ", ".join(f"{phase} {seconds}s" for phase, seconds in startup_times.items()))
+
+async def on_stop(app):
+    """Runs after updates stopped coming in but while the bot can still send: running jobs
+    get drain_timeout to finish, whatever is left stays in the journal for the next start"""
+    global draining
+    draining = True
+    print(f"Draining: {job_queue.in_flight()} running, {job_queue.depth()} queued")
+    if not await job_queue.drain(drain_timeout):
+        print(f"Drain timed out, {job_queue.in_flight()} jobs will be resumed after restart")
+    await job_queue.stop()
+
+async def on_shutdown(app):
+    await job_queue.stop()
+    if process_pool: process_pool.shutdown(cancel_futures=True)
+    if http_fetcher: await http_fetcher.close()
+
+def build_application(with_updater=True):
+    builder = ApplicationBuilder().token(telegram_token).post_init(on_startup).post_stop(on_stop).post_shutdown(on_shutdown)
+    # Webhook cluster workers get their updates from the dispatcher process instead
+    if not with_updater: builder = builder.updater(None)
+    # A local Bot API server is needed to download files larger than 20 MB
+    if telegram_base_url: builder = builder.base_url(telegram_base_url)
+    if telegram_base_file_url: builder = builder.base_file_url(telegram_base_file_url)
+    if telegram_local_mode: builder = builder.local_mode(True)
+    app = builder.build()
+    app.add_handler(TypeHandler(Update, note_first_update), group=-1)
     app.add_handler(CommandHandler('start', handle_start))
+    app.add_handler(CommandHandler('cancel', handle_cancel))
+    app.add_handler(CommandHandler('batch', handle_batch))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_summarize))
     app.add_handler(MessageHandler(filters.PHOTO | filters.VOICE | filters.AUDIO | filters.VIDEO | filters.VIDEO_NOTE, handle_media_message))
     app.add_handler(MessageHandler(filters.Document.ALL, handle_document))
     app.add_handler(CallbackQueryHandler(handle_button_click))
+    return app
+
+def main():
+    if webhook_url:
+        full_url = f"{webhook_url.rstrip('/')}/{webhook_path}"
+        if webhook_workers > 1:
+            from webhook import run_webhook_cluster
+            run_webhook_cluster(partial(build_application, with_updater=False), telegram_token, full_url,
+                                webhook_listen, webhook_port, webhook_path, webhook_secret, webhook_workers,
+                                stop_timeout=drain_timeout + 30)
+            return
+        print(f"Bot is listening for webhooks on {webhook_listen}:{webhook_port}/{webhook_path}")
+        build_application().run_webhook(listen=webhook_listen, port=webhook_port, url_path=webhook_path,
+                                        webhook_url=full_url, secret_token=webhook_secret or None,
+                                        allowed_updates=Update.ALL_TYPES)
+        return
+    app = build_application()
     print("Bot is polling...")
     app.run_polling()
 
+imported_at = time.perf_counter()
+
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,67 @@
+import contextvars
+import json
+import time
+import uuid
+from contextlib import contextmanager
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+STAGE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80, 160, 320, 640)
+
+STAGE_SECONDS = Histogram("bot_stage_seconds", "Time spent in each pipeline stage", ["handler", "stage"], buckets=STAGE_BUCKETS)
+GEMINI_CALL_SECONDS = Histogram("gemini_call_seconds", "Latency of Gemini API calls", ["model", "kind"], buckets=STAGE_BUCKETS)
+GEMINI_LIMITER_WAIT_SECONDS = Histogram("gemini_limiter_wait_seconds", "Time spent waiting for the rate limiter", buckets=STAGE_BUCKETS)
+GEMINI_RATE_LIMITED = Counter("gemini_rate_limited_total", "Gemini calls rejected with 429/RESOURCE_EXHAUSTED", ["model"])
+GEMINI_FALLBACKS = Counter("gemini_fallbacks_total", "Gemini calls moved to the fallback model after a rate limit", ["model"])
+GEMINI_RETRIES = Counter("gemini_retries_total", "Gemini calls retried after a rate limit", ["kind"])
+GEMINI_BACKOFF_SECONDS = Counter("gemini_backoff_seconds_total", "Time slept in backoff before retrying Gemini calls")
+GEMINI_TOKENS = Counter("gemini_tokens_total", "Tokens reported by Gemini usage metadata", ["model", "direction"])
+GEMINI_IN_FLIGHT = Gauge("gemini_in_flight", "Gemini calls currently in flight")
+CACHE_REQUESTS = Counter("cache_requests_total", "Cache lookups", ["cache", "result"])
+QUEUE_DEPTH = Gauge("job_queue_depth", "Jobs waiting in the queue", ["lane"])
+JOBS_IN_FLIGHT = Gauge("jobs_in_flight", "Jobs currently running", ["lane"])
+STARTUP_SECONDS = Gauge("bot_startup_seconds", "Seconds from process start to each startup phase", ["phase"])
+
+request_id_var = contextvars.ContextVar("request_id", default="-")
+
+
+def new_request_id():
+    request_id = uuid.uuid4().hex[:12]
+    request_id_var.set(request_id)
+    return request_id
+
+
+def set_request_id(request_id):
+    request_id_var.set(request_id)
+
+
+def log_event(event, **fields):
+    """One JSON object per line, tagged with the current request ID"""
+    record = {"ts": round(time.time(), 3), "event": event, "request_id": request_id_var.get()}
+    record.update(fields)
+    print(json.dumps(record, ensure_ascii=False, default=str), flush=True)
+
+
+@contextmanager
+def stage(handler, name):
+    started = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.labels(handler, name).observe(elapsed)
+        log_event("stage", handler=handler, stage=name, seconds=round(elapsed, 3), status=status)
+
+
+def record_usage(model, usage):
+    if not usage: return
+    GEMINI_TOKENS.labels(model, "in").inc(usage.prompt_token_count or 0)
+    GEMINI_TOKENS.labels(model, "out").inc(usage.candidates_token_count or 0)
+
+
+def start_metrics_server(port, addr="127.0.0.1"):
+    start_http_server(port, addr=addr)
+    print(f"📈 Metrics on http://{addr}:{port}/metrics")
@@ -0,0 +1,45 @@
+import asyncio
+from collections import deque
+
+
+# PyPDF2 is imported inside the functions: they run in the worker processes,
+# the bot process itself never needs it
+def count_pages(path):
+    from PyPDF2 import PdfReader
+    return len(PdfReader(path).pages)
+
+
+def extract_page_range(path, start, stop):
+    """Runs in a worker process: each worker opens the file itself, so nothing big is pickled"""
+    from PyPDF2 import PdfReader
+    reader = PdfReader(path)
+    texts = []
+    for page in reader.pages[start:stop]:
+        try:
+            t = page.extract_text()
+        except Exception as e:
+            print(f"PDF page error: {e}")
+            t = None
+        if t: texts.append(t)
+    return texts
+
+
+async def iter_pdf_pages(path, executor, pages_per_task=8, max_pending=4):
+    """Yield page texts in order while later pages are still being parsed in the process pool.
+
+    At most max_pending page ranges are in flight, which keeps memory flat for big files
+    and lets the consumer start summarizing the first chunks right away.
+    """
+    loop = asyncio.get_running_loop()
+    total = await loop.run_in_executor(executor, count_pages, path)
+    ranges = deque((start, min(start + pages_per_task, total)) for start in range(0, total, pages_per_task))
+    pending = deque()
+    try:
+        while ranges or pending:
+            while ranges and len(pending) < max_pending:
+                start, stop = ranges.popleft()
+                pending.append(loop.run_in_executor(executor, extract_page_range, path, start, stop))
+            for text in await pending.popleft():
+                yield text
+    finally:
+        for future in pending: future.cancel()
@@ -0,0 +1,101 @@
+import asyncio
+import time
+from telegram.error import RetryAfter, TelegramError
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+
+def split_message(text, limit=TELEGRAM_MESSAGE_LIMIT):
+    parts = []
+    while len(text) > limit:
+        cut = text.rfind('\n', 0, limit)
+        if cut <= 0: cut = limit
+        parts.append(text[:cut])
+        text = text[cut:].lstrip('\n')
+    parts.append(text)
+    return parts
+
+
+class ProgressiveReply:
+    """A placeholder message that is edited with partial results while a summary is being built.
+
+    update() is cheap and can be called as often as needed: edits are coalesced so the
+    message is changed at most once per interval, which keeps us under Telegram's edit limits.
+    """
+
+    def __init__(self, bot, chat_id, placeholder="⏳ Обрабатываю...", interval=1.5):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.placeholder = placeholder
+        self.interval = interval
+        self.message = None
+        self.latest = None
+        self.shown = None
+        self.next_edit_at = 0.0
+        self.flush_task = None
+
+    async def start(self):
+        self.message = await self.bot.send_message(chat_id=self.chat_id, text=self.placeholder)
+        self.shown = self.placeholder
+        self.next_edit_at = time.monotonic() + self.interval
+
+    def update(self, text):
+        if not self.message or not text: return
+        # Partial results only show the tail that fits in one message
+        self.latest = text if len(text) <= TELEGRAM_MESSAGE_LIMIT else "…" + text[-(TELEGRAM_MESSAGE_LIMIT - 1):]
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = asyncio.create_task(self._flush())
+
+    async def _flush(self):
+        while self.latest != self.shown:
+            delay = self.next_edit_at - time.monotonic()
+            if delay > 0: await asyncio.sleep(delay)
+            text = self.latest
+            try:
+                await self.message.edit_text(text)
+                self.shown = text
+            except RetryAfter as e:
+                retry_after = e.retry_after
+                if hasattr(retry_after, "total_seconds"): retry_after = retry_after.total_seconds()
+                self.next_edit_at = time.monotonic() + retry_after
+                continue
+            except TelegramError as e:
+                # "Message is not modified" and similar, nothing to retry
+                print(f"Progress edit skipped: {e}")
+                self.shown = text
+            self.next_edit_at = time.monotonic() + self.interval
+
+    async def _stop_flush(self):
+        if self.flush_task and not self.flush_task.done():
+            self.flush_task.cancel()
+            try:
+                await self.flush_task
+            except asyncio.CancelledError:
+                pass
+
+    async def finish(self, text, reply_markup=None):
+        """Replace the placeholder with the final text, returns the last message (the one with the markup)"""
+        await self._stop_flush()
+        parts = split_message(text)
+        last = len(parts) - 1
+        message = self.message
+        for i, part in enumerate(parts):
+            markup = reply_markup if i == last else None
+            if i == 0 and self.message:
+                if part == self.shown and markup is None: continue
+                try:
+                    await self.message.edit_text(part, reply_markup=markup)
+                    continue
+                except TelegramError as e:
+                    print(f"Final edit failed, sending a new message: {e}")
+            message = await self.bot.send_message(chat_id=self.chat_id, text=part, reply_markup=markup)
+        return message
+
+    async def abort(self, text):
+        """Replace the placeholder or partial result with text when the job is dropped"""
+        await self._stop_flush()
+        if not self.message: return
+        try:
+            await self.message.edit_text(text)
+        except TelegramError as e:
+            print(f"Progress edit skipped: {e}")
@@ -0,0 +1,69 @@
+import asyncio
+import random
+import re
+import time
+
+
+class RateLimiter:
+    """Process-wide token buckets for requests-per-minute and tokens-per-minute budgets.
+
+    Every Gemini call awaits acquire() before hitting the API, so bursts are smoothed out
+    instead of being rejected with 429s. A budget of 0 disables that bucket.
+    """
+
+    def __init__(self, rpm=0, tpm=0):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.requests = float(rpm)
+        self.tokens = float(tpm)
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = None
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.updated_at
+        self.updated_at = now
+        if self.rpm: self.requests = min(self.rpm, self.requests + elapsed * self.rpm / 60)
+        if self.tpm: self.tokens = min(self.tpm, self.tokens + elapsed * self.tpm / 60)
+        return now
+
+    async def acquire(self, tokens=0):
+        # Created lazily so the limiter binds to the running event loop
+        if self.lock is None: self.lock = asyncio.Lock()
+        if self.tpm: tokens = min(tokens, self.tpm)
+        # Holding the lock while waiting keeps callers in FIFO order
+        async with self.lock:
+            while True:
+                now = self._refill()
+                wait = self.paused_until - now
+                if self.rpm and self.requests < 1:
+                    wait = max(wait, (1 - self.requests) * 60 / self.rpm)
+                if self.tpm and self.tokens < tokens:
+                    wait = max(wait, (tokens - self.tokens) * 60 / self.tpm)
+                if wait <= 0: break
+                await asyncio.sleep(wait)
+            if self.rpm: self.requests -= 1
+            if self.tpm: self.tokens -= tokens
+
+    def record_usage(self, estimated, actual):
+        """Correct the token bucket once the real token count of a call is known"""
+        if self.tpm and actual: self.tokens -= actual - estimated
+
+    def pause(self, seconds):
+        """Hold back every caller, e.g. when the API tells us when to retry"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+def backoff_delay(attempt, base=2.0, cap=60.0):
+    """Exponential backoff with full jitter"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def parse_retry_after(error):
+    """Extract the retry hint (seconds) from a Gemini 429 error, if there is one"""
+    text = str(error)
+    match = re.search(r"retryDelay['\"]?\s*[:=]\s*['\"]?(\d+(?:\.\d+)?)s", text)
+    if not match: match = re.search(r"retry in (\d+(?:\.\d+)?)\s*s", text, re.IGNORECASE)
+    if match: return float(match.group(1))
+    return None
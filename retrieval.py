@@ -0,0 +1,45 @@
+import math
+import re
+from collections import Counter
+
+WORD_RE = re.compile(r"\w+")
+# Crude stemming: Russian words change endings a lot, a fixed prefix matches most forms
+STEM_LENGTH = 6
+
+
+def tokenize(text):
+    return [word[:STEM_LENGTH] for word in WORD_RE.findall(text.lower()) if len(word) > 1]
+
+
+class BM25Index:
+    """Okapi BM25 over a list of passages, small enough to build per document on demand."""
+
+    def __init__(self, passages, k1=1.5, b=0.75):
+        self.passages = passages
+        self.k1 = k1
+        self.b = b
+        self.term_freqs = [Counter(tokenize(p)) for p in passages]
+        self.lengths = [sum(tf.values()) for tf in self.term_freqs]
+        self.avg_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0.0
+        doc_freqs = Counter()
+        for tf in self.term_freqs: doc_freqs.update(tf.keys())
+        n = len(passages)
+        self.idf = {term: math.log(1 + (n - df + 0.5) / (df + 0.5)) for term, df in doc_freqs.items()}
+
+    def scores(self, query):
+        terms = [t for t in set(tokenize(query)) if t in self.idf]
+        scores = []
+        for tf, length in zip(self.term_freqs, self.lengths):
+            norm = self.k1 * (1 - self.b + self.b * length / self.avg_length) if self.avg_length else self.k1
+            score = 0.0
+            for term in terms:
+                f = tf.get(term)
+                if f: score += self.idf[term] * f * (self.k1 + 1) / (f + norm)
+            scores.append(score)
+        return scores
+
+    def top(self, query, k=4):
+        """Best k passages in document order, so the excerpts read naturally"""
+        scores = self.scores(query)
+        best = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:k]
+        return [self.passages[i] for i in sorted(best) if scores[i] > 0]
@@ -0,0 +1,55 @@
+import re
+from collections import namedtuple
+
+Route = namedtuple("Route", "site max_tokens model")
+
+ROUTE_RE = re.compile(r"^\s*([\w*]+)\s*(?:<\s*(\d+))?\s*=\s*(\S+)\s*$")
+
+
+def parse_routes(spec):
+    """Parse "site=model" and "site<tokens=model" entries separated by commas.
+
+    site is a call site (map, reduce, summary, media, qa, keywords) or * for any;
+    <tokens limits the entry to inputs up to that many estimated tokens."""
+    routes = []
+    for entry in spec.split(","):
+        if not entry.strip(): continue
+        match = ROUTE_RE.match(entry)
+        if not match: raise ValueError(f"Bad model route: {entry.strip()!r}")
+        site, max_tokens, model = match.groups()
+        routes.append(Route(site, int(max_tokens) if max_tokens else None, model))
+    return routes
+
+
+class ModelRouter:
+    """Picks the model for a call from its site and input size.
+
+    An entry for the exact site wins over a * entry, and an entry with a size limit
+    wins over one without; nothing matching means the default model."""
+
+    def __init__(self, default, routes, fallback=None):
+        self.default = default
+        self.routes = routes
+        self.fallback = fallback
+
+    def route(self, site, tokens=None):
+        candidates = [r for r in self.routes if r.site in (site, "*")
+                      and (r.max_tokens is None or (tokens is not None and tokens <= r.max_tokens))]
+        if not candidates: return self.default
+        best = min(candidates, key=lambda r: (r.site != site, r.max_tokens is None, r.max_tokens or 0))
+        return best.model
+
+    def fallback_for(self, model):
+        """Model to switch to after a rate limit, None when there is nothing else to try"""
+        if self.fallback and self.fallback != model: return self.fallback
+        return None
+
+    def validate(self, available):
+        """Drop routes (and the fallback) naming models the API doesn't list, returns what was dropped"""
+        known = {name.removeprefix("models/") for name in available}
+        dropped = [r.model for r in self.routes if r.model not in known]
+        self.routes = [r for r in self.routes if r.model in known]
+        if self.fallback and self.fallback not in known:
+            dropped.append(self.fallback)
+            self.fallback = None
+        return dropped
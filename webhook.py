@@ -0,0 +1,105 @@
+import asyncio
+import hmac
+import json
+import multiprocessing
+import os
+import signal
+import tornado.httpserver
+import tornado.web
+from telegram import Bot, Update
+
+
+def find_chat_id(data):
+    """Chat (or user) an update belongs to, used to pin all updates of a chat to one worker"""
+    if isinstance(data, dict):
+        chat = data.get("chat")
+        if isinstance(chat, dict) and "id" in chat: return chat["id"]
+        for key in ("message", "edited_message", "channel_post", "callback_query", "my_chat_member", "chat_member"):
+            if key in data:
+                found = find_chat_id(data[key])
+                if found is not None: return found
+        sender = data.get("from")
+        if isinstance(sender, dict) and "id" in sender: return sender["id"]
+    return None
+
+
+def worker_main(build_app, updates, index):
+    # The dispatcher decides when to stop and tells workers through the queue
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    os.environ["WORKER_INDEX"] = str(index)
+    asyncio.run(run_worker(build_app, updates))
+
+
+async def run_worker(build_app, updates):
+    """One bot worker: a full Application without an updater, fed with updates by the dispatcher"""
+    app = build_app()
+    await app.initialize()
+    if app.post_init: await app.post_init(app)
+    await app.start()
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            data = await loop.run_in_executor(None, updates.get)
+            if data is None: break
+            await app.update_queue.put(Update.de_json(json.loads(data), app.bot))
+    finally:
+        await app.stop()
+        if app.post_stop: await app.post_stop(app)
+        if app.post_shutdown: await app.post_shutdown(app)
+        await app.shutdown()
+
+
+class UpdateHandler(tornado.web.RequestHandler):
+    def initialize(self, queues, secret):
+        self.queues = queues
+        self.secret = secret
+
+    def post(self):
+        if self.secret:
+            token = self.request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+            if not hmac.compare_digest(token, self.secret):
+                self.set_status(403)
+                return
+        try:
+            data = json.loads(self.request.body)
+        except ValueError:
+            self.set_status(400)
+            return
+        chat_id = find_chat_id(data) or 0
+        try:
+            self.queues[hash(chat_id) % len(self.queues)].put_nowait(self.request.body.decode("utf-8"))
+        except Exception:
+            # Worker backlog is full: a non-2xx status makes Telegram redeliver later
+            self.set_status(503)
+
+
+def run_webhook_cluster(build_app, token, webhook_url, listen, port, url_path, secret, workers, max_backlog=1000, stop_timeout=60):
+    """Receive Telegram updates on one endpoint and spread them over several worker processes.
+
+    Updates of the same chat always go to the same worker, so per-chat queue limits and
+    /cancel keep working. Caches and other state live in SQLite files shared by all workers.
+    """
+    ctx = multiprocessing.get_context("spawn")
+    queues = [ctx.Queue(maxsize=max_backlog) for _ in range(workers)]
+    processes = [ctx.Process(target=worker_main, args=(build_app, q, i), name=f"bot-worker-{i}") for i, q in enumerate(queues)]
+    for process in processes: process.start()
+
+    async def serve():
+        async with Bot(token) as bot:
+            await bot.set_webhook(url=webhook_url, secret_token=secret or None, allowed_updates=Update.ALL_TYPES)
+        web_app = tornado.web.Application([(rf"/{url_path}", UpdateHandler, {"queues": queues, "secret": secret})])
+        server = tornado.httpserver.HTTPServer(web_app)
+        server.listen(port, address=listen)
+        print(f"Webhook dispatcher listening on {listen}:{port}/{url_path} with {workers} workers")
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM): loop.add_signal_handler(sig, stop.set)
+        await stop.wait()
+        server.stop()
+
+    try:
+        asyncio.run(serve())
+    finally:
+        for q in queues: q.put(None)
+        for process in processes: process.join(timeout=stop_timeout)
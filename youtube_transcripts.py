@@ -0,0 +1,93 @@
+import json
+import re
+import urllib.parse
+
+VIDEO_ID_RE = re.compile(r"^[A-Za-z0-9_-]{11}$")
+YOUTUBE_HOSTS = ("youtube.com", "youtube-nocookie.com", "youtu.be")
+PATH_PREFIXES = ("shorts", "embed", "live", "v", "e")
+
+# One client for the whole process, it keeps its HTTP session between calls.
+# Created on first use, the library is slow to import.
+api = None
+
+
+def get_api():
+    global api
+    if api is None:
+        from youtube_transcript_api import YouTubeTranscriptApi
+        api = YouTubeTranscriptApi()
+    return api
+
+
+def extract_video_id(url):
+    """Normalize any YouTube URL form (watch, youtu.be, shorts, embed, live, mobile, music) to the video ID"""
+    parsed = urllib.parse.urlsplit(url.strip())
+    host = (parsed.hostname or "").lower()
+    if not any(host == h or host.endswith("." + h) for h in YOUTUBE_HOSTS): return None
+    parts = [p for p in parsed.path.split("/") if p]
+    candidate = None
+    if host.endswith("youtu.be"):
+        candidate = parts[0] if parts else None
+    elif parts and parts[0] in PATH_PREFIXES and len(parts) > 1:
+        candidate = parts[1]
+    else:
+        candidate = urllib.parse.parse_qs(parsed.query).get("v", [None])[0]
+    if candidate and VIDEO_ID_RE.match(candidate): return candidate
+    return None
+
+
+def format_timestamp(seconds):
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, secs = divmod(rest, 60)
+    if hours: return f"{hours}:{minutes:02d}:{secs:02d}"
+    return f"{minutes:02d}:{secs:02d}"
+
+
+def segments_to_paragraphs(segments, pause=2.0, soft_limit=60.0, hard_limit=120.0):
+    """Group transcript segments into timestamped paragraphs, breaking at pauses in speech,
+    at sentence ends once a paragraph is long enough, and always after hard_limit seconds.
+    The chunker then splits long videos at these natural boundaries."""
+    paragraphs = []
+    current, started_at, last_end = [], None, None
+    for start, duration, text in segments:
+        text = text.replace("\n", " ").strip()
+        if not text: continue
+        if current:
+            length = start - started_at
+            sentence_end = current[-1].endswith((".", "!", "?", "…"))
+            if (start - last_end >= pause or length >= hard_limit
+                    or (length >= soft_limit and sentence_end)):
+                paragraphs.append(f"[{format_timestamp(started_at)}] " + " ".join(current))
+                current = []
+        if not current: started_at = start
+        current.append(text)
+        last_end = start + duration
+    if current: paragraphs.append(f"[{format_timestamp(started_at)}] " + " ".join(current))
+    return paragraphs
+
+
+def fetch_segments(video_id, languages, cache=None):
+    """List the available transcripts once and pick the best one in a single pass:
+    manual or generated in the preferred languages, then whatever the video has.
+    Results are cached by video ID. Returns (language_code, [(start, duration, text), ...])."""
+    cache_key = cache.make_key("transcript", video_id, ",".join(languages)) if cache else None
+    if cache_key:
+        stored = cache.get(cache_key)
+        if stored:
+            data = json.loads(stored)
+            return data["language"], [tuple(s) for s in data["segments"]]
+
+    transcripts = get_api().list(video_id)
+    try:
+        transcript = transcripts.find_transcript(languages)
+    except Exception:
+        transcript = next(iter(transcripts), None)
+    if transcript is None: return None, []
+
+    fetched = transcript.fetch()
+    segments = [(s.start, s.duration, s.text) for s in fetched.snippets]
+    print(f"Debug - Got {transcript.language_code} transcript ({'generated' if transcript.is_generated else 'manual'}), segments: {len(segments)}")
+    if cache_key and segments:
+        cache.set(cache_key, json.dumps({"language": transcript.language_code, "segments": segments}))
+    return transcript.language_code, segments